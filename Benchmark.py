@@ -0,0 +1,299 @@
+import argparse
+import contextlib
+import io
+import json
+import os  # Required for file operations
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+import Dice_Simulation as DicePyFile
+import Excel_Export as ExcelPyFile
+import Family_Simulation as FamilyPyFile
+import Jit_Kernels as JitPyFile
+import Marbles_Drop_Simulation as MarblesPyFile
+import Monte_Carlo_Simulation as MontePyFile
+from Rng_Provider import random_uint32, random_words
+
+# Folder of this script, used to find Coursework.xlsx for the Excel benchmarks
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TRIAL_COUNTS = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+# Startup budget of the entry point, and the heavy packages it must not import before a feature needs them
+IMPORT_TIME_BUDGET = 0.5
+LAZY_MODULES = ["matplotlib", "pandas", "openpyxl", "scipy", "numba"]
+# Main only parses arguments at startup, so it must not import numpy either
+ENTRY_POINT_LAZY_MODULES = {"Main": LAZY_MODULES + ["numpy"]}
+
+
+# Synthetic pi results in the layout update_excel_file expects, with experiments_count rounds
+def fake_pi_results(experiments_count):
+    rng = np.random.default_rng(0)
+    sample_type_list = [1000, 10000, 100000, 1000000]
+    pi_results = {count: list(rng.normal(np.pi, 0.01, experiments_count)) for count in sample_type_list}
+    probability_list = [
+        {"Round": experiment + 1, "Trial Count": count, "Probability Circle": 0.13,
+         "Probability Square": 0.04, "Probability Union": 0.17}
+        for count in sample_type_list for experiment in range(experiments_count)
+    ]
+    return sample_type_list, pi_results, probability_list
+
+def bench_excel_update(experiments_count):
+    sample_type_list, pi_results, probability_list = fake_pi_results(experiments_count)
+    MontePyFile.update_excel_file("./Coursework.xlsx", "Monte Carlo Simulation", sample_type_list, pi_results,
+                                  probability_list)
+
+
+# Every hot path: (name, function of the trial count, largest trial count worth running)
+BENCHMARKS = [
+    ("drop_marbles_scalar", lambda n: MontePyFile.drop_marbles(n, "scalar"), 10**6),
+    ("drop_marbles_numpy", lambda n: MontePyFile.drop_marbles(n, "numpy"), 10**7),
+    ("drop_marbles_jit", lambda n: MontePyFile.drop_marbles(n, "jit"), 10**7 if JitPyFile.NUMBA_AVAILABLE else 10**6),
+    ("dice_rolls_loop", lambda n: DicePyFile.simulate_dice_rolls(n, 10, 6, 30, "loop"), 10**5),
+    ("dice_rolls_batched", lambda n: DicePyFile.simulate_dice_rolls(n, 10, 6, 30, "batched"), 10**7),
+    ("dice_rolls_jit", lambda n: DicePyFile.simulate_dice_rolls(n, 10, 6, 30, "jit"),
+     10**7 if JitPyFile.NUMBA_AVAILABLE else 10**5),
+    ("marbles_simulation", lambda n: MarblesPyFile.simulation(n), 10**7),
+    ("marbles_simulation_jit", lambda n: MarblesPyFile.simulation(n, engine="jit"),
+     10**7 if JitPyFile.NUMBA_AVAILABLE else 10**6),
+    ("marbles_density", lambda n: MarblesPyFile.simulation_density(n), 10**7),
+    ("family_simulation", lambda n: FamilyPyFile.family_simulation(n, export_trials=False), 10**4),
+    ("family_loop", lambda n: FamilyPyFile.simulate_families_loop(n), 10**5),
+    ("family_batched", lambda n: FamilyPyFile.simulate_families(n), 10**7),
+    ("family_jit", lambda n: FamilyPyFile.simulate_families(n, jit=True), 10**7 if JitPyFile.NUMBA_AVAILABLE else 10**5),
+    ("excel_trials_writer", lambda n: ExcelPyFile.write_trials_workbook(
+        "./bench_trials.xlsx", "Trials", ["Trial", "Value"], ((i, i) for i in range(n))), 10**5),
+    ("excel_monte_carlo_update", bench_excel_update, 10**3),
+]
+
+
+# Time one benchmark at one trial count (best of repeat runs), then measure its peak Python memory once
+def run_benchmark(function, trial_count, repeat=1, measure_memory=True):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(trial_count)
+        timings.append(time.perf_counter() - start_time)
+
+    peak_memory = None
+    if measure_memory:
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(trial_count)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        "trials": trial_count,
+        "seconds": seconds,
+        "samples_per_second": trial_count / seconds if seconds > 0 else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+# Run the selected benchmarks inside a scratch folder, so the images and workbooks in the repo are not touched
+def run_benchmarks(names=None, trial_counts=None, max_trials=None, repeat=1, measure_memory=True):
+    trial_counts = trial_counts or DEFAULT_TRIAL_COUNTS
+    results = []
+
+    original_dir = os.getcwd()
+    scratch_dir = tempfile.mkdtemp(prefix="mc_benchmark_")
+    shutil.copy(os.path.join(REPO_DIR, "Coursework.xlsx"), scratch_dir)
+    os.chdir(scratch_dir)
+    try:
+        for name, function, benchmark_max in BENCHMARKS:
+            if names and name not in names:
+                continue
+            for trial_count in trial_counts:
+                if trial_count > benchmark_max or (max_trials and trial_count > max_trials):
+                    continue
+                result = run_benchmark(function, trial_count, repeat, measure_memory)
+                result["benchmark"] = name
+                results.append(result)
+                print(format_result(result))
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "results": results,
+    }
+
+def format_result(result):
+    memory = f"{result['peak_memory_bytes'] / 2**20:9.1f} MiB" if result["peak_memory_bytes"] is not None else ""
+    return (f"{result['benchmark']:>26} N={result['trials']:<9} {result['seconds']:9.4f} s "
+            f"{result['samples_per_second']:14,.0f} samples/s {memory}")
+
+# Time "import module" in fresh interpreters (best of repeat) and list the lazy modules it pulled in
+def measure_import_time(module="Main", repeat=5):
+    lazy_modules = ENTRY_POINT_LAZY_MODULES.get(module, LAZY_MODULES)
+    script = (f"import sys, time; start = time.perf_counter(); import {module}; "
+              f"print(time.perf_counter() - start); "
+              f"print(','.join(name for name in {lazy_modules!r} if name in sys.modules))")
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR, capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        timings.append(float(output[0]))
+        loaded = [name for name in output[1].split(",") if name] if len(output) > 1 else []
+    return {"module": module, "seconds": min(timings), "loaded_lazy_modules": loaded}
+
+# Check the import time of every entry point against the budget. Returns the failures as messages
+def check_import_budget(budget=IMPORT_TIME_BUDGET, modules=("Main", "Monte_Carlo_Simulation", "Dice_Simulation",
+                                                            "Family_Simulation", "Marbles_Drop_Simulation")):
+    failures = []
+    print(f"\nImport times (budget {budget:.2f} s):")
+    for module in modules:
+        result = measure_import_time(module)
+        print(f"{module:>26} {result['seconds']:9.4f} s  {', '.join(result['loaded_lazy_modules'])}")
+        if result["seconds"] > budget:
+            failures.append(f"{module} took {result['seconds']:.3f} s to import")
+        if result["loaded_lazy_modules"]:
+            failures.append(f"{module} imported {', '.join(result['loaded_lazy_modules'])} at startup")
+    return failures
+
+# Every jit kernel with seeded inputs: (name, kernel, arguments)
+def jit_kernel_checks(trial_count=100_000, seed=0):
+    rng = np.random.default_rng(seed)
+    x, y = rng.uniform(-2, 4, trial_count), rng.uniform(-2, 2, trial_count)
+    rolls = rng.integers(1, 7, size=(trial_count, 10), dtype=np.int16)
+    uniforms = random_uint32(rng, 3 * trial_count).reshape(3, trial_count)
+    words = random_words(rng, -(-trial_count // 21))
+    return [
+        ("count_marble_hits", JitPyFile.count_marble_hits, (x, y)),
+        ("classify_marbles", JitPyFile.classify_marbles, (x, y)),
+        ("dice_sums", JitPyFile.dice_sums, (rolls,)),
+        ("family_girl_counts", JitPyFile.family_girl_counts, (uniforms, np.int64(0.49 * 2**32))),
+        ("family_popcount_counts", JitPyFile.family_popcount_counts, (words, 3, trial_count)),
+    ]
+
+# Every jit engine with the engine it replaces: (name, run(engine) -> statistics, reference engine).
+# The family runs cover the popcount path (p_girl = 0.5) and the threshold path
+def jit_engine_checks(trial_count=100_000, seed=0):
+    def families(children, p_girl):
+        return lambda engine: FamilyPyFile.simulate_families(
+            trial_count, children, p_girl, rng=np.random.default_rng(seed), jit=engine == "jit")[0]
+
+    return [
+        ("drop_marbles", lambda engine: MontePyFile.drop_marbles(trial_count, engine, np.random.default_rng(seed)),
+         "numpy"),
+        ("simulate_dice_rolls", lambda engine: DicePyFile.simulate_dice_rolls(
+            trial_count, 10, 6, 30, engine, rng=np.random.default_rng(seed))[:2], "batched"),
+        ("marbles_simulation", lambda engine: MarblesPyFile.simulation(
+            trial_count, np.random.default_rng(seed), engine)[:2], "numpy"),
+        ("simulate_families", families(3, 0.5), "batched"),
+        ("simulate_families c=7", families(7, 0.5), "batched"),
+        ("simulate_families p=0.49", families(3, 0.49), "batched"),
+        ("simulate_families p=1", families(3, 1.0), "batched"),
+    ]
+
+# True when the compiled and interpreted results of a kernel are the same
+def kernel_matches(kernel, arguments):
+    compiled = kernel(*arguments)
+    interpreted = JitPyFile.python_kernel(kernel)(*arguments)
+    return all(np.array_equal(a, b) for a, b in zip(np.atleast_1d(compiled), np.atleast_1d(interpreted)))
+
+# True when a jit run gives the same statistics as the reference engine
+def engine_matches(run, reference_engine):
+    return all(np.array_equal(a, b) for a, b in zip(run("jit"), run(reference_engine)))
+
+# Check that the jit engines match the engines they replace: every kernel must give the same result compiled and
+# interpreted (only with numba, without it both are the same function), and a seeded jit run must give the same
+# statistics as the array engine with the same seed. Returns the mismatches as messages
+def check_jit_backends(trial_count=100_000, seed=0):
+    failures = []
+    print(f"\nJit kernels on the {JitPyFile.jit_backend()} backend, N={trial_count}:")
+    for name, kernel, arguments in jit_kernel_checks(trial_count, seed):
+        if not JitPyFile.NUMBA_AVAILABLE:
+            print(f"{name:>26} compiled vs interpreted: skipped (numba not installed)")
+            continue
+        matches = kernel_matches(kernel, arguments)
+        print(f"{name:>26} compiled vs interpreted: {'match' if matches else 'MISMATCH'}")
+        if not matches:
+            failures.append(f"{name} gives different results compiled and interpreted")
+    for name, run, reference_engine in jit_engine_checks(trial_count, seed):
+        matches = engine_matches(run, reference_engine)
+        print(f"{name:>26} jit vs {reference_engine}: {'match' if matches else 'MISMATCH'}")
+        if not matches:
+            failures.append(f"{name} gives different statistics on the jit and {reference_engine} engines")
+    return failures
+
+# Compare the throughput with a saved baseline. Returns the regressions: (benchmark, trials, baseline, current)
+# for every result more than threshold (a fraction) slower than the baseline
+def compare_with_baseline(report, baseline, threshold=0.10):
+    baseline_results = {(result["benchmark"], result["trials"]): result for result in baseline["results"]}
+    regressions = []
+
+    print(f"\nComparison with baseline from {baseline.get('created', 'unknown date')}:")
+    for result in report["results"]:
+        previous = baseline_results.get((result["benchmark"], result["trials"]))
+        if previous is None or not previous["samples_per_second"]:
+            continue
+        change = result["samples_per_second"] / previous["samples_per_second"] - 1
+        is_regression = change < -threshold
+        if is_regression:
+            regressions.append((result["benchmark"], result["trials"],
+                                previous["samples_per_second"], result["samples_per_second"]))
+        print(f"{result['benchmark']:>26} N={result['trials']:<9} {change:+8.1%}{'  REGRESSION' if is_regression else ''}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths.")
+    parser.add_argument("--benchmarks", nargs="+", choices=[name for name, _, _ in BENCHMARKS], default=None)
+    parser.add_argument("--trials", type=lambda text: int(float(text)), nargs="+", default=None,
+                        help="Trial counts to run (default: 1e3 to 1e7)")
+    parser.add_argument("--max-trials", type=lambda text: int(float(text)), default=None,
+                        help="Skip trial counts above this value")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs per measurement, the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak memory run")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed throughput drop against the baseline, as a fraction (default: 0.10)")
+    parser.add_argument("--import-budget", type=float, nargs="?", const=IMPORT_TIME_BUDGET, default=None,
+                        help=f"Only check the import time of the entry points (default budget: {IMPORT_TIME_BUDGET} s)")
+    parser.add_argument("--check-jit", action="store_true",
+                        help="Only check that the jit kernels match the interpreted kernels and the array engines")
+    args = parser.parse_args(argv)
+
+    if args.import_budget is not None or args.check_jit:
+        failures = []
+        if args.import_budget is not None:
+            failures += check_import_budget(args.import_budget)
+        if args.check_jit:
+            failures += check_jit_backends()
+        for failure in failures:
+            print(failure)
+        return 1 if failures else 0
+
+    report = run_benchmarks(args.benchmarks, args.trials, args.max_trials, args.repeat, not args.no_memory)
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_with_baseline(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}.")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import json
+import os  # Required for file operations
+import time
+
+# Seconds between two checkpoint saves of a long run
+CHECKPOINT_INTERVAL = 60.0
+
+
+# Periodic checkpoint of a long simulation batch in a local JSON file.
+# The simulation calls start(parameters) to get the state saved by an interrupted run with the same parameters
+# (None when there is nothing to resume), save(state) whenever due() says so, and finish() once it completes.
+# Every save goes through a temporary file and os.replace, so a run killed mid-save keeps the previous checkpoint
+class Checkpoint:
+
+    def __init__(self, path, interval_seconds=CHECKPOINT_INTERVAL, resume=True):
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self.resume = resume
+        self.parameters = None
+        self.last_save_time = time.perf_counter()
+
+    def start(self, parameters):
+        # Round-trip through JSON so lists and tuples compare equal with the saved parameters
+        self.parameters = json.loads(json.dumps(parameters))
+        self.last_save_time = time.perf_counter()
+
+        saved = read_checkpoint(self.path) if self.resume else None
+        if saved is None:
+            return None
+        if saved["parameters"] != self.parameters:
+            raise ValueError(f"The checkpoint {self.path} was saved with different parameters: {saved['parameters']}. "
+                             f"Delete it or run with the same parameters.")
+        print(f"Resuming from the checkpoint saved at {saved['saved']}")
+        return saved["state"]
+
+    def due(self):
+        return time.perf_counter() - self.last_save_time >= self.interval_seconds
+
+    def save(self, state):
+        checkpoint = {"parameters": self.parameters, "saved": time.strftime("%Y-%m-%dT%H:%M:%S"), "state": state}
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(checkpoint, file, default=lambda value: value.tolist())  # numpy arrays in generator states
+        os.replace(temporary_path, self.path)
+        self.last_save_time = time.perf_counter()
+
+    # The run completed, its checkpoint is no longer needed
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# The saved checkpoint ({"parameters", "saved", "state"}), or None when there is none
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
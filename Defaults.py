@@ -0,0 +1,13 @@
+# Names and default folders shared by the command line and the simulation modules. This module imports nothing,
+# so Main can build its argument parser without loading numpy or any simulation module
+
+# Bit generators of Rng_Provider.BIT_GENERATORS, the numpy.random class of the same name
+BIT_GENERATOR_NAMES = ["PCG64", "PCG64DXSM", "Philox", "SFC64"]
+# Point samplers of Samplers.SAMPLERS
+SAMPLER_NAMES = ["uniform", "halton", "sobol", "stratified", "antithetic", "importance"]
+
+# Default folder of the result cache and its size limit
+CACHE_DIR = "./.simulation_cache"
+MAX_CACHE_BYTES = 512 * 2**20
+# Default folder holding one sub-folder per simulation run
+RESULTS_DIR = "./results"
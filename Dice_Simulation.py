@@ -1,195 +1,363 @@
-from itertools import product
+from functools import lru_cache
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from openpyxl import Workbook
-from openpyxl import load_workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 import os  # Required for file operations
+import time
 
+from Excel_Export import write_summary_sheet, write_trials_workbook
+from Instrumentation import add_count, phase
+from Output_Pipeline import run_output
+from Plotting import PLOT_LOCK, pyplot
+from Result_Cache import cached_call
+from Rng_Provider import RngProvider, as_generator, make_provider
+from Streaming import Snapshot, show_progress
 
-def dice_simulation_Main():
-    calculate_exact_probability()
-    calculate_simulated_probability()
+# Number of trials rolled per batch by the batched engine, keeps memory constant for any trial count
+DICE_CHUNK_SIZE = 100_000
+# Chunks per shard of a distributed run
+DICE_CHUNKS_PER_SHARD = 100
 
-def calculate_exact_probability():
 
-    target_sum = 30
-    num_dice = 10
-    sides = 6
+def dice_simulation_Main(trial_count=None, output=None):
+    calculate_exact_probability()
+    calculate_simulated_probability(trial_count, keep_trials=True, output=output)
 
-    # Generate all possible combinations of dice rolls
-    all_combinations = product(range(1, sides + 1), repeat=num_dice)
+def calculate_exact_probability(target_sum=30, num_dice=10, sides=6):
+
+    # Exact number of ways to reach every sum, built by dynamic programming instead of enumerating all rolls
+    sum_counts = exact_sum_counts(num_dice, sides)
 
     # Count the number of combinations where the sum of rolls equals the target sum
-    favorable_outcomes = sum(1 for combo in all_combinations if sum(combo) == target_sum)
+    favorable_outcomes = sum_counts[target_sum] if 0 <= target_sum < len(sum_counts) else 0
 
     # Calculate the total number of possible outcomes
     total_outcomes = sides ** num_dice
 
     exact_probability = favorable_outcomes / total_outcomes
 
-    print(f"Exact probability of obtaining a sum of 30 when rolling 10 dice: {exact_probability}")
-
-def calculate_simulated_probability ():
-
-    trial_count = int(input("How many trials do you want to run? "))
+    print(f"Exact probability of obtaining a sum of {target_sum} when rolling {num_dice} dice: {exact_probability}")
 
-    target_sum = 30
-    num_dice = 10
-    sides = 6
+    return exact_probability, exact_sum_pmf(num_dice, sides)
 
-    target_sum_count = 0
+# Number of ways to obtain each sum s (the index) with num_dice dice, cached per (num_dice, sides)
+@lru_cache(maxsize=None)
+def exact_sum_counts(num_dice, sides):
+    counts = [1]  # Zero dice: one way to obtain a sum of 0
 
-    simulation_results = [] # Stores detailed results for each trial 
+    for _ in range(num_dice):
+        # Adding a die: ways(s) = ways(s - 1) + ... + ways(s - sides), kept as a sliding window sum
+        new_counts = [0] * (len(counts) + sides)
+        window = 0
+        for s in range(1, len(new_counts)):
+            if s - 1 < len(counts):
+                window += counts[s - 1]
+            if s - sides - 1 >= 0:
+                window -= counts[s - sides - 1]
+            new_counts[s] = window
+        counts = new_counts
 
-    sums_of_simulation = []
+    return tuple(counts)
 
-    for trial in range(trial_count):
+# Probability mass function of the sum of num_dice dice as {sum: probability}
+def exact_sum_pmf(num_dice=10, sides=6):
+    sum_counts = exact_sum_counts(num_dice, sides)
+    total_outcomes = sides ** num_dice
 
-        sum_of_each_attempt = 0
+    return {s: sum_counts[s] / total_outcomes for s in range(num_dice, num_dice * sides + 1)}
 
-        result = 0
+# engine = "batched" rolls (chunk, num_dice) matrices with a numpy Generator, engine = "loop" keeps the original loop,
+# engine = "jit" rolls the same matrices and sums them in a Jit_Kernels kernel (compiled when numba is installed)
+# keep_trials = True keeps one record per trial for the Excel sheet, otherwise memory stays constant
+# store is an optional Result_Store.RunWriter for the raw sums and the aggregated histogram
+# checkpoint is an optional Checkpoint.Checkpoint for resuming an interrupted batched run
+# cache is an optional Result_Cache.ResultCache, seeded runs without trial records or a store then reuse the histogram
+# distributed is an optional Distributed.Coordinator that rolls the chunks as shards on its workers
+# output is an optional Output_Pipeline.OutputPipeline that draws the chart and writes the workbooks in the background
+# progress = True rolls the chunks through stream_dice_estimates and shows a progress line, the results stay the same
+def calculate_simulated_probability (trial_count=None, engine="batched", keep_trials=False, chunk_size=None, rng=None,
+                                     store=None, checkpoint=None, cache=None, distributed=None, output=None,
+                                     progress=False):
 
-        for _ in range(num_dice):
-            side_value = np.random.randint(1, sides + 1)
-            sum_of_each_attempt += side_value
+    if trial_count is None:
+        trial_count = int(input("How many trials do you want to run? "))
 
-        if sum_of_each_attempt == target_sum:
-            target_sum_count += 1
-            result = True
-        else:
-            result = False
-
-        simulation_results.append({
-            'Trial': trial + 1,
-            'Summation': sum_of_each_attempt,
-            'Result': result
-        })
+    target_sum = 30
+    num_dice = 10
+    sides = 6
 
-        sums_of_simulation.append(sum_of_each_attempt)
+    if progress and (engine == "loop" or keep_trials or store is not None or checkpoint is not None
+                     or distributed is not None):
+        raise ValueError("The progress display needs the batched or jit engine, without trial records, a store, "
+                         "a checkpoint or distributed workers.")
+
+    with phase("sampling"):
+        target_sum_count, sum_histogram, simulation_results = cached_call(
+            cache if not keep_trials and store is None else None, "dice",
+            {"trial_count": trial_count, "num_dice": num_dice, "sides": sides, "target_sum": target_sum,
+             "engine": engine, "chunk_size": chunk_size or DICE_CHUNK_SIZE}, rng,
+            lambda: simulate_dice_rolls_with_progress(trial_count, num_dice, sides, target_sum,
+                                                      chunk_size or DICE_CHUNK_SIZE, rng, engine == "jit")
+            if progress else
+            simulate_dice_rolls(trial_count, num_dice, sides, target_sum, engine, keep_trials,
+                                chunk_size or DICE_CHUNK_SIZE, rng, store, checkpoint, distributed))
+        add_count("samples", trial_count)
 
     # Calculate the simulated probability
     simulated_probability = target_sum_count / trial_count
 
     print(f"Simulated probability of achieving a sum of 30 by rolling 10 dice over {trial_count} trials: {simulated_probability}")
 
-    # Create a bar chart for the frequency of sums from the simulation
-    plt.figure(figsize=(10, 6))
-    plt.hist(sums_of_simulation, bins=range(20, 61), edgecolor='black', align='left')
-    plt.title('Frequency of Different Sums from 10 Dice Rolls')
-    plt.xlabel('Sum of Rolls')
-    plt.ylabel('Frequency')
-    plt.xticks(range(20, 61))  # Set x-ticks from 20 to 60
-    plt.grid(True)
-    plt.tight_layout()
-
-    # Save the bar chart as an image
-    output_image_path = "./dice_simulation_barchart.png"
-    if os.path.exists(output_image_path):
-        os.remove(output_image_path)  # Delete the existing file
-    plt.savefig(output_image_path)
-    print(f"Bar Chart saved to {output_image_path}")
-
-     # =======================================================================================================================
-
-    # Save the workbook
+    if store is not None:
+        store.append("histogram", summation=np.arange(sum_histogram.size), frequency=sum_histogram)
+        store.set_summary(trial_count=trial_count, target_sum_count=target_sum_count,
+                          simulated_probability=simulated_probability)
+
+    run_output(output, plot_dice_histogram, sum_histogram)
+    run_output(output, export_dice_results, trial_count, target_sum_count, simulated_probability, sum_histogram,
+               simulation_results, num_dice, sides)
+
+    return simulated_probability, sum_histogram
+
+# Bar chart of the frequency of every sum from 20 to 60
+def plot_dice_histogram(sum_histogram):
+    with phase("plotting"), PLOT_LOCK:
+        plt = pyplot()
+
+        # Create a bar chart for the frequency of sums from the simulation
+        plt.figure(figsize=(10, 6))
+        plt.bar(range(20, 61), sum_histogram[20:61], width=1, edgecolor='black')
+        plt.title('Frequency of Different Sums from 10 Dice Rolls')
+        plt.xlabel('Sum of Rolls')
+        plt.ylabel('Frequency')
+        plt.xticks(range(20, 61))  # Set x-ticks from 20 to 60
+        plt.grid(True)
+        plt.tight_layout()
+
+        # Save the bar chart as an image
+        output_image_path = "./dice_simulation_barchart.png"
+        if os.path.exists(output_image_path):
+            os.remove(output_image_path)  # Delete the existing file
+        plt.savefig(output_image_path)
+        plt.close()
+        print(f"Bar Chart saved to {output_image_path}")
+
+# Save the raw trials (when kept) to their own streamed workbook and the summary to the coursework workbook
+def export_dice_results(trial_count, target_sum_count, simulated_probability, sum_histogram, simulation_results,
+                        num_dice, sides):
     output_excel_path = "./Coursework.xlsx"
 
-    # Check if the file exists
-    if os.path.exists(output_excel_path):
-        # Load the existing workbook
-        wb = load_workbook(output_excel_path)
-        # Check if the sheet already exists
-        if "Dice Simulation" in wb.sheetnames:
-            # Remove the existing sheet
-            del wb["Dice Simulation"]
-    else:
-        # Create a new workbook
-        wb = Workbook()
-
-    # Create a new sheet
-    ws = wb.create_sheet("Dice Simulation")
-
-    # Define styles
-    bold_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    center_align = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-
-    # Write the header row
-    ws.merge_cells(start_row=1, start_column=1, end_row=2, end_column=8)
-    cell = ws.cell(row=1, column=1, value="Statistics - Dice Simulation Results")
-    ws.row_dimensions[1].height = 20
-    ws.row_dimensions[2].height = 20
-    cell.font = Font(bold=True, color="FFFFFF", size=15)
-    cell.fill = header_fill
-    cell.alignment = center_align
-    cell.border = thin_border
-
-    # Write the headers
-    headers = ["Trial", "Summation","Result"]
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=5, column=col_num, value=header)
-        cell.font = bold_font
-        cell.fill = header_fill
-        cell.alignment = center_align
-        cell.border = thin_border
-    
-        ws.row_dimensions[5].height = 25
-
-    # Adjust column widths
-    column_widths = [10, 12, 20, 5, 5, 5, 40, 15]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[chr(64 + i)].width = width
-
-    # Populate trial data
-    for row_num, result in enumerate(simulation_results, 6):
-        ws.cell(row=row_num, column=1, value=result['Trial']).border = thin_border
-        ws.cell(row=row_num, column=2, value=result['Summation']).border = thin_border
-        ws.cell(row=row_num, column=3, value=result['Result']).border = thin_border
-
-    # Write the statistical data section
-    ws.merge_cells(start_row=5, start_column=7, end_row=5, end_column=8)
-    ws.row_dimensions[5].height = 25
-    cell = ws.cell(row=5, column=7, value="Statistical Values")
-    cell.font = bold_font
-    cell.fill = header_fill
-    cell.alignment = center_align
-    cell.border = thin_border
-
     stat_headers = [
         "Trial Count",
         "Count of Obtaining a Sum = 30",
         "Probability of Obtaining a Sum = 30", 
     ]
 
-    for row_num, header in enumerate(stat_headers, 6):
-        cell = ws.cell(row=row_num, column=7, value=header)
-        #cell.font = bold_font
-        #cell.fill = header_fill
-        cell.border = thin_border
-
     stat_values = [
         trial_count,
         target_sum_count,
         simulated_probability,
     ]
 
-    for row_num, value in enumerate(stat_values, 6):
-        cell = ws.cell(row=row_num, column=8, value=value)
-        cell.border = thin_border
+    if simulation_results is not None:
+        output_trials_path = "./Dice_Simulation_Trials.xlsx"
+        write_trials_workbook(
+            output_trials_path, "Dice Simulation", ["Trial", "Summation", "Result"],
+            ((result['Trial'], result['Summation'], result['Result']) for result in simulation_results),
+            column_widths=[10, 12, 20]
+        )
+        stat_headers.append("Trial Records")
+        stat_values.append(output_trials_path)
+
+    write_summary_sheet(
+        output_excel_path, "Dice Simulation", "Statistics - Dice Simulation Results",
+        ["Sum", "Frequency"],
+        [(total, int(sum_histogram[total])) for total in range(num_dice, num_dice * sides + 1)],
+        stat_headers, stat_values
+    )
+
+# Roll the dice trial_count times and return (target_sum_count, sum_histogram, simulation_results)
+# sum_histogram[s] is the number of trials whose dice added up to s, simulation_results is None unless keep_trials
+# With a store, the batched engine also appends every chunk of raw sums to its "trials" table
+def simulate_dice_rolls(trial_count, num_dice, sides, target_sum, engine="batched", keep_trials=False,
+                        chunk_size=None, rng=None, store=None, checkpoint=None, distributed=None):
+    if distributed is not None:
+        if engine == "loop" or keep_trials or checkpoint is not None or (store is not None and store.save_raw):
+            raise ValueError("Distributed runs need the batched or jit engine, without trial records, raw sums "
+                             "or a checkpoint.")
+        return simulate_dice_rolls_distributed(trial_count, num_dice, sides, target_sum, chunk_size or DICE_CHUNK_SIZE,
+                                               rng, distributed, engine == "jit")
+    if engine == "loop":
+        if checkpoint is not None:
+            raise ValueError("Checkpointing needs the batched engine.")
+        return simulate_dice_rolls_loop(trial_count, num_dice, sides, target_sum, keep_trials, rng)
+    if engine in ("batched", "jit"):
+        return simulate_dice_rolls_batched(trial_count, num_dice, sides, target_sum, keep_trials,
+                                           chunk_size or DICE_CHUNK_SIZE, rng, store, checkpoint, engine == "jit")
+    raise ValueError(f"Unknown engine '{engine}'. Use 'loop', 'batched' or 'jit'.")
+
+# Original trial-by-trial loop, one random draw per die
+def simulate_dice_rolls_loop(trial_count, num_dice, sides, target_sum, keep_trials=False, rng=None):
+    randint = as_generator(rng).integers if rng is not None else np.random.randint
+
+    target_sum_count = 0
+    sum_histogram = np.zeros(num_dice * sides + 1, dtype=np.int64)
+    simulation_results = [] if keep_trials else None # Stores detailed results for each trial
+
+    for trial in range(trial_count):
+
+        sum_of_each_attempt = 0
+
+        for _ in range(num_dice):
+            side_value = randint(1, sides + 1)
+            sum_of_each_attempt += side_value
 
-    # Save the workbook after all data is written
-    wb.save(output_excel_path)
-    print(f"Excel file saved to {output_excel_path}")
+        result = bool(sum_of_each_attempt == target_sum)
+        if result:
+            target_sum_count += 1
+
+        if keep_trials:
+            simulation_results.append({
+                'Trial': trial + 1,
+                'Summation': int(sum_of_each_attempt),
+                'Result': result
+            })
+
+        sum_histogram[sum_of_each_attempt] += 1
+
+    return target_sum_count, sum_histogram, simulation_results
+
+# Roll a (chunk, num_dice) matrix at a time, sum along axis 1 and accumulate a histogram of the sums
+# With an RngProvider or an int seed every chunk draws from its own child stream, so any chunk can be replayed on its
+# own and a seed gives the same histogram as on the distributed engine (and shares its cache entries)
+# A checkpoint saves the completed trial count, the histogram and the generator state after whole chunks.
+# The per-trial records are not checkpointed, and raw sums already sent to a store are not sent again
+# jit = True sums the rolls with the Jit_Kernels.dice_sums kernel, the draws and results stay the same
+def simulate_dice_rolls_batched(trial_count, num_dice, sides, target_sum, keep_trials=False,
+                                chunk_size=None, rng=None, store=None, checkpoint=None, jit=False):
+    rng_provider = make_provider(rng) if isinstance(rng, (RngProvider, int)) else None
+    if rng_provider is None:
+        rng = as_generator(rng)
+    chunk_size = chunk_size or DICE_CHUNK_SIZE
+    if checkpoint is not None and keep_trials:
+        raise ValueError("Checkpointing does not keep the per-trial records, run without keep_trials.")
+
+    sum_histogram = np.zeros(num_dice * sides + 1, dtype=np.int64)
+    simulation_results = [] if keep_trials else None
+
+    completed = 0
+    if checkpoint is not None:
+        saved_state = checkpoint.start({
+            "trial_count": trial_count, "num_dice": num_dice, "sides": sides, "chunk_size": chunk_size,
+            "seed": rng_provider.seed if rng_provider is not None else None,
+            "bit_generator": rng_provider.bit_generator if rng_provider is not None else None,
+        })
+        if saved_state is not None:
+            completed = saved_state["completed"]
+            sum_histogram[:] = saved_state["sum_histogram"]
+            if rng_provider is None:
+                rng.bit_generator.state = saved_state["rng_state"]
+
+    while completed < trial_count:
+        size = min(chunk_size, trial_count - completed)
+        chunk_rng = rng_provider.generator(completed // chunk_size) if rng_provider is not None else rng
+        sums = roll_dice_sums(chunk_rng, size, num_dice, sides, jit)
+        sum_histogram += np.bincount(sums, minlength=sum_histogram.size)
+
+        if store is not None and store.save_raw:
+            store.append("trials", summation=sums.astype(np.uint16))
+
+        if keep_trials:
+            simulation_results.extend(
+                {'Trial': completed + i + 1, 'Summation': int(total), 'Result': bool(total == target_sum)}
+                for i, total in enumerate(sums)
+            )
+
+        completed += size
+
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save({
+                "completed": completed, "sum_histogram": sum_histogram.tolist(),
+                "rng_state": rng.bit_generator.state if rng_provider is None else None,
+            })
+
+    if checkpoint is not None:
+        checkpoint.finish()
+
+    target_sum_count = int(sum_histogram[target_sum]) if 0 <= target_sum < sum_histogram.size else 0
+
+    return target_sum_count, sum_histogram, simulation_results
+
+# Sums of size rolls of num_dice dice, drawn as one (size, num_dice) matrix
+def roll_dice_sums(rng, size, num_dice, sides, jit=False):
+    rolls = rng.integers(1, sides + 1, size=(size, num_dice), dtype=np.int16)
+    if jit:
+        from Jit_Kernels import dice_sums
+        return dice_sums(rolls)
+    return rolls.sum(axis=1, dtype=np.int64)
+
+# Stream the dice estimate: roll the chunks of the batched engine (same streams, same results) and yield a
+# Streaming.Snapshot after every chunk with the target sum count and the sum histogram so far, the probability
+# of the target sum and its binomial standard error. Closing the generator stops before the next chunk
+def stream_dice_estimates(trial_count, num_dice=10, sides=6, target_sum=30, chunk_size=None, rng=None, jit=False):
+    rng_provider = make_provider(rng) if isinstance(rng, (RngProvider, int)) else None
+    if rng_provider is None:
+        rng = as_generator(rng)
+    chunk_size = chunk_size or DICE_CHUNK_SIZE
+
+    sum_histogram = np.zeros(num_dice * sides + 1, dtype=np.int64)
+    start_time = time.perf_counter()
+    completed = 0
+
+    while completed < trial_count:
+        size = min(chunk_size, trial_count - completed)
+        chunk_rng = rng_provider.generator(completed // chunk_size) if rng_provider is not None else rng
+        sums = roll_dice_sums(chunk_rng, size, num_dice, sides, jit)
+        sum_histogram += np.bincount(sums, minlength=sum_histogram.size)
+        completed += size
+
+        target_sum_count = int(sum_histogram[target_sum]) if 0 <= target_sum < sum_histogram.size else 0
+        probability = target_sum_count / completed
+        yield Snapshot(completed, {"target_sum_count": target_sum_count, "sum_histogram": sum_histogram.copy()},
+                       probability, np.sqrt(probability * (1 - probability) / completed),
+                       time.perf_counter() - start_time)
+
+# Batched dice run through stream_dice_estimates with a progress line, returns the simulate_dice_rolls results
+def simulate_dice_rolls_with_progress(trial_count, num_dice, sides, target_sum, chunk_size, rng, jit=False):
+    snapshot = show_progress(stream_dice_estimates(trial_count, num_dice, sides, target_sum, chunk_size, rng, jit),
+                             trial_count, "Dice simulation")
+    return snapshot.counts["target_sum_count"], snapshot.counts["sum_histogram"], None
+
+# Roll the chunks of the batched engine as shards of DICE_CHUNKS_PER_SHARD chunks on a Distributed.Coordinator.
+# Every chunk draws from the same child stream as in a local batched run with an RngProvider, so the merged
+# histogram is the same. Workers only send back the sum histogram of their shard
+def simulate_dice_rolls_distributed(trial_count, num_dice, sides, target_sum, chunk_size, rng, coordinator, jit=False,
+                                    chunks_per_shard=DICE_CHUNKS_PER_SHARD):
+    if not isinstance(rng, (RngProvider, int)) and rng is not None:
+        raise ValueError("Distributed runs need a seed or an RngProvider, not a running generator.")
+    rng_provider = make_provider(rng)
+
+    chunk_count = -(-trial_count // chunk_size)
+    shards = [(first_chunk, min(first_chunk + chunks_per_shard, chunk_count), trial_count, chunk_size, num_dice, sides,
+               jit, rng_provider)
+              for first_chunk in range(0, chunk_count, chunks_per_shard)]
+
+    sum_histogram = np.zeros(num_dice * sides + 1, dtype=np.int64)
+    for shard_histogram in coordinator.run("dice", shards):
+        sum_histogram += shard_histogram
+
+    target_sum_count = int(sum_histogram[target_sum]) if 0 <= target_sum < sum_histogram.size else 0
+    return target_sum_count, sum_histogram, None
+
+# Worker side of a distributed dice run: the sum histogram of chunks first_chunk to last_chunk (excluded)
+def dice_shard(shard):
+    first_chunk, last_chunk, trial_count, chunk_size, num_dice, sides, jit, rng_provider = shard
+    sum_histogram = np.zeros(num_dice * sides + 1, dtype=np.int64)
+    for chunk in range(first_chunk, last_chunk):
+        size = min(chunk_size, trial_count - chunk * chunk_size)
+        sums = roll_dice_sums(rng_provider.generator(chunk), size, num_dice, sides, jit)
+        sum_histogram += np.bincount(sums, minlength=sum_histogram.size)
+    return sum_histogram
 
 
 if __name__ == "__main__":
     calculate_exact_probability()
-    calculate_simulated_probability ()
\ No newline at end of file
+    calculate_simulated_probability (keep_trials=True)
\ No newline at end of file
@@ -0,0 +1,214 @@
+import importlib
+import ipaddress
+import multiprocessing
+import os  # Required for file operations
+import queue
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+# Default address of the coordinator: an ephemeral port on this machine, enough for local workers
+DEFAULT_ADDRESS = ("127.0.0.1", 0)
+# Shared secret of the coordinator and its workers, from the SIMULATION_AUTHKEY environment variable.
+# The messages are pickled, so anyone holding the key can run code on the other side. Without SIMULATION_AUTHKEY
+# the key is a public string, which is only accepted for loopback addresses (local workers)
+LOOPBACK_AUTHKEY = b"monte-carlo-simulation"
+DEFAULT_AUTHKEY = os.environ.get("SIMULATION_AUTHKEY", "").encode() or LOOPBACK_AUTHKEY
+# Times a shard is sent again after the worker running it disconnected
+MAX_SHARD_RETRIES = 3
+
+# Function every shard kind runs on a worker, as "module:function" so a worker only imports the simulation it runs.
+# Each function takes one shard description and returns a small mergeable accumulator
+SHARD_FUNCTIONS = {
+    "pi": "Monte_Carlo_Simulation:pi_shard",
+    "dice": "Dice_Simulation:dice_shard",
+}
+
+
+# Runs shards of a simulation on worker processes connected over sockets (multiprocessing.connection, pickled
+# messages, authenticated with authkey). Workers connect to the coordinator, take one shard at a time and send back
+# its accumulator. A shard whose worker disconnects is sent to the next free worker, up to max_retries times.
+# local_workers starts that many worker processes on this machine, remote workers join with run_worker(address)
+class Coordinator:
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, local_workers=0, max_retries=MAX_SHARD_RETRIES):
+        check_authkey(address, authkey)
+        self.address = address
+        self.authkey = authkey
+        self.local_workers = local_workers
+        self.max_retries = max_retries
+
+    # Run every shard of the given kind, returns the accumulators in shard order
+    def run(self, kind, shards):
+        if kind not in SHARD_FUNCTIONS:
+            raise ValueError(f"Unknown shard kind '{kind}'. Use one of: {', '.join(SHARD_FUNCTIONS)}.")
+        shards = list(shards)
+        run = ShardRun(kind, shards, self.max_retries)
+        if not shards:
+            return []
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            host, port = listener.address
+            print(f"Coordinator running {len(shards)} {kind} shards on {host}:{port}")
+            accept_thread = threading.Thread(target=self.accept_workers, args=(listener, run), daemon=True)
+            accept_thread.start()
+
+            context = multiprocessing.get_context("spawn")
+            processes = [context.Process(target=run_worker, args=(listener.address, self.authkey), daemon=True)
+                         for _ in range(self.local_workers)]
+            for process in processes:
+                process.start()
+            restarts = 0
+
+            try:
+                while not run.finished.wait(0.1):
+                    # Replace local workers that died while shards are left, their shards are already queued again
+                    for index, process in enumerate(processes):
+                        if not process.is_alive() and restarts < self.local_workers * self.max_retries:
+                            restarts += 1
+                            processes[index] = context.Process(target=run_worker, args=(listener.address, self.authkey),
+                                                               daemon=True)
+                            processes[index].start()
+                    if processes and not any(process.is_alive() for process in processes):
+                        run.fail(f"All {len(processes)} local workers died after {restarts} restarts.")
+            finally:
+                run.finished.set()
+                # Wake the accept thread with a last connection so it sees the run is over
+                try:
+                    Client(listener.address, authkey=self.authkey).close()
+                except OSError:
+                    pass
+                accept_thread.join(timeout=5)
+                for process in processes:
+                    process.join(timeout=5)
+                    if process.is_alive():
+                        process.terminate()
+
+        if run.error is not None:
+            raise RuntimeError(run.error)
+        return run.results
+
+    def accept_workers(self, listener, run):
+        while not run.finished.is_set():
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                continue  # A client that failed the authentication
+            if run.finished.is_set():
+                connection.close()
+                break
+            threading.Thread(target=run.serve, args=(connection,), daemon=True).start()
+
+
+# True for an address only this machine can connect to
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+# Refuse the public loopback key on a network address, where anyone reaching the port could send pickles
+def check_authkey(address, authkey):
+    if authkey == LOOPBACK_AUTHKEY and not is_loopback(address[0]):
+        raise ValueError(f"Set the SIMULATION_AUTHKEY environment variable to a secret shared by the coordinator "
+                         f"and the workers before using the network address {address[0]}:{address[1]}.")
+
+
+# Shared state of one Coordinator.run: the queue of shards left, the accumulators received so far
+# and the retry count of every shard. serve() feeds one connected worker until the run is over
+class ShardRun:
+
+    def __init__(self, kind, shards, max_retries):
+        self.kind = kind
+        self.shards = shards
+        self.max_retries = max_retries
+        self.results = [None] * len(shards)
+        self.retries = [0] * len(shards)
+        self.remaining = len(shards)
+        self.pending = queue.Queue()
+        for index in range(len(shards)):
+            self.pending.put(index)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.error = None
+
+    def serve(self, connection):
+        with connection:
+            while not self.finished.is_set():
+                try:
+                    index = self.pending.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                try:
+                    connection.send((self.kind, self.shards[index]))
+                    status, value = connection.recv()
+                except (OSError, EOFError):
+                    self.retry(index)
+                    return
+
+                if status == "error":
+                    self.fail(f"Shard {index} failed on a worker:\n{value}")
+                    return
+                with self.lock:
+                    self.results[index] = value
+                    self.remaining -= 1
+                    if self.remaining == 0:
+                        self.finished.set()
+
+            try:
+                connection.send(None)  # Tell the worker to stop
+            except OSError:
+                pass
+
+    # The worker of a shard disconnected, queue the shard again unless it ran out of retries
+    def retry(self, index):
+        with self.lock:
+            self.retries[index] += 1
+            if self.retries[index] > self.max_retries:
+                self.fail(f"Shard {index} lost its worker {self.retries[index]} times, giving up.")
+                return
+        print(f"Worker lost, retrying shard {index}")
+        self.pending.put(index)
+
+    def fail(self, message):
+        self.error = message
+        self.finished.set()
+
+
+# Worker loop: connect to the coordinator at address and run shards until it says stop or goes away.
+# A shard that raises is reported back to the coordinator, which stops the run
+def run_worker(address, authkey=DEFAULT_AUTHKEY, retry_seconds=0):
+    check_authkey(address, authkey)
+    deadline = time.monotonic() + retry_seconds
+    while True:
+        try:
+            connection = Client(tuple(address), authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(1)  # The coordinator is not listening yet
+
+    functions = {}
+    with connection:
+        while True:
+            try:
+                message = connection.recv()
+            except (OSError, EOFError):
+                return
+            if message is None:
+                return
+
+            kind, shard = message
+            try:
+                if kind not in functions:
+                    module_name, function_name = SHARD_FUNCTIONS[kind].split(":")
+                    functions[kind] = getattr(importlib.import_module(module_name), function_name)
+                reply = ("ok", functions[kind](shard))
+            except Exception:
+                reply = ("error", traceback.format_exc())
+            connection.send(reply)
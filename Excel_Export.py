@@ -0,0 +1,154 @@
+import os  # Required for file operations
+import threading
+
+# openpyxl is imported inside the functions, so it is only loaded when a run actually exports to Excel
+from Instrumentation import add_count, timed
+
+# Maximum number of rows in one Excel sheet, larger trial tables spill over to extra sheets
+MAX_EXCEL_ROWS = 1_048_576
+
+TITLE_STYLE = "Simulation Title"
+HEADER_STYLE = "Simulation Header"
+CELL_STYLE = "Simulation Cell"
+
+_workbook_locks = {}  # Absolute workbook path -> lock
+_workbook_locks_lock = threading.Lock()
+
+
+# Lock of the workbook at path. Every load-modify-save of a workbook holds it, so the output pipeline's thread and
+# the main thread never interleave their saves of the same file
+def workbook_lock(path):
+    with _workbook_locks_lock:
+        return _workbook_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+# Save through a temporary file and os.replace, so an interrupted save never leaves a half-written workbook
+def save_workbook(wb, path):
+    temporary_path = f"{path}.tmp"
+    wb.save(temporary_path)
+    os.replace(temporary_path, path)
+
+
+# Register the shared named styles once per workbook, so cells reference a style instead of copying it
+def add_named_styles(wb):
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+
+    existing_styles = set(wb.named_styles)
+    thin_side = Side(style='thin')
+    thin_border = Border(left=thin_side, right=thin_side, top=thin_side, bottom=thin_side)
+    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    center_align = Alignment(horizontal="center", vertical="center")
+
+    styles = [
+        NamedStyle(name=TITLE_STYLE, font=Font(bold=True, color="FFFFFF", size=15),
+                   fill=header_fill, alignment=center_align, border=thin_border),
+        NamedStyle(name=HEADER_STYLE, font=Font(bold=True, color="FFFFFF"),
+                   fill=header_fill, alignment=center_align, border=thin_border),
+        NamedStyle(name=CELL_STYLE, border=thin_border),
+    ]
+    for style in styles:
+        if style.name not in existing_styles:
+            wb.add_named_style(style)
+
+
+# Replace sheet_name in the workbook at output_path with a summary: title, a frequency table in columns A-B
+# and the statistical values in columns G-H. Only aggregates are written, so the sheet stays small
+@timed("excel export")
+def write_summary_sheet(output_path, sheet_name, title, histogram_headers, histogram_rows, stat_headers, stat_values):
+    with workbook_lock(output_path):
+        write_summary_sheet_locked(output_path, sheet_name, title, histogram_headers, histogram_rows, stat_headers,
+                                   stat_values)
+    add_count("rows written", len(histogram_rows) + len(stat_headers))
+    print(f"Excel file saved to {output_path}")
+
+# Body of write_summary_sheet, run while holding the workbook's lock
+def write_summary_sheet_locked(output_path, sheet_name, title, histogram_headers, histogram_rows, stat_headers,
+                               stat_values):
+    from openpyxl import Workbook, load_workbook
+    from openpyxl.utils import get_column_letter
+
+    # Check if the file exists
+    if os.path.exists(output_path):
+        wb = load_workbook(output_path)
+        if sheet_name in wb.sheetnames:
+            del wb[sheet_name]
+    else:
+        wb = Workbook()
+
+    add_named_styles(wb)
+    ws = wb.create_sheet(sheet_name)
+
+    # Write the header row
+    ws.merge_cells(start_row=1, start_column=1, end_row=2, end_column=8)
+    ws.cell(row=1, column=1, value=title).style = TITLE_STYLE
+    ws.row_dimensions[1].height = 20
+    ws.row_dimensions[2].height = 20
+    ws.row_dimensions[5].height = 25
+
+    # Adjust column widths
+    column_widths = [12, 14, 5, 5, 5, 5, 40, 15]
+    for i, width in enumerate(column_widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    # Write the frequency table
+    for col_num, header in enumerate(histogram_headers, 1):
+        ws.cell(row=5, column=col_num, value=header).style = HEADER_STYLE
+    for row_num, row in enumerate(histogram_rows, 6):
+        for col_num, value in enumerate(row, 1):
+            ws.cell(row=row_num, column=col_num, value=value).style = CELL_STYLE
+
+    # Write the statistical data section
+    ws.merge_cells(start_row=5, start_column=7, end_row=5, end_column=8)
+    ws.cell(row=5, column=7, value="Statistical Values").style = HEADER_STYLE
+    for row_num, (header, value) in enumerate(zip(stat_headers, stat_values), 6):
+        ws.cell(row=row_num, column=7, value=header).style = CELL_STYLE
+        ws.cell(row=row_num, column=8, value=value).style = CELL_STYLE
+
+    save_workbook(wb, output_path)
+
+
+# Stream the per-trial rows into a new workbook in write-only mode, so memory stays flat for any number of rows.
+# Once a sheet is full the rows continue on "<sheet_name> (2)", "<sheet_name> (3)", ...
+# Returns the number of rows written
+@timed("excel export")
+def write_trials_workbook(output_path, sheet_name, headers, rows, column_widths=None):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    add_named_styles(wb)
+
+    rows_per_sheet = MAX_EXCEL_ROWS - 1  # One row per sheet is taken by the headers
+    rows_written = 0
+    ws = None
+
+    for row in rows:
+        if rows_written % rows_per_sheet == 0:
+            sheet_number = rows_written // rows_per_sheet + 1
+            suffix = f" ({sheet_number})" if sheet_number > 1 else ""
+            ws = wb.create_sheet(sheet_name[:31 - len(suffix)] + suffix)  # Excel limits sheet names to 31 characters
+
+            if column_widths:
+                for i, width in enumerate(column_widths, 1):
+                    ws.column_dimensions[get_column_letter(i)].width = width
+
+            header_cells = []
+            for header in headers:
+                cell = WriteOnlyCell(ws, value=header)
+                cell.style = HEADER_STYLE
+                header_cells.append(cell)
+            ws.append(header_cells)
+
+        ws.append(row)
+        rows_written += 1
+
+    # A workbook needs at least one sheet
+    if ws is None:
+        wb.create_sheet(sheet_name[:31]).append(headers)
+
+    with workbook_lock(output_path):
+        save_workbook(wb, output_path)  # Replaces the existing file
+    add_count("rows written", rows_written)
+    print(f"{rows_written} trial rows saved to {output_path}")
+
+    return rows_written
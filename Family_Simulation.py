@@ -1,41 +1,55 @@
-import random
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-import matplotlib.pyplot as plt
 import os  # Required for file operations
+import numpy as np
 
-def familySimulation_Main():
-    family_simulation()
-    
-def family_simulation():
+from Excel_Export import write_summary_sheet, write_trials_workbook
+from Instrumentation import add_count, phase
+from Output_Pipeline import run_output
+from Plotting import PLOT_LOCK, pyplot
+from Result_Cache import cached_call
+from Rng_Provider import RngProvider, as_generator, as_python_random, random_uint32, random_words
+from Running_Statistics import RunningStatistics, cumulative_proportions, wilson_interval
 
-    trial_count = int(input("How many trials do you want to run? "))
+# Number of families sampled per batch by the batched engine, keeps memory constant for any trial count
+FAMILY_CHUNK_SIZE = 1_000_000
+# Number of set bits of every byte value, for popcounts on NumPy versions before 2.0 (no np.bitwise_count)
+BYTE_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
 
-    at_least_one_girl = 0  # Counter for trials with at least one girl
-    all_girls = 0  # Counter for trials with all children being girls
+def familySimulation_Main(trial_count=None, output=None):
+    family_simulation(trial_count, output=output)
 
-    simulation_results = []  # Stores detailed results for each trial 
+# engine = "batched" samples whole chunks of families with array operations, engine = "loop" keeps the original
+# child-by-child loop, engine = "jit" counts the girls family by family in a Jit_Kernels kernel.
+# children and p_girl set the family size and the probability that a child is a girl
+# curve_engine = "streaming" updates the convergence curves in the loop engine's simulation loop,
+# curve_engine = "cumsum" builds them afterwards with a single NumPy cumsum over the trial results (always for "batched")
+# export_trials = False only writes the aggregated summary (girl count frequencies) to Excel
+# plot = False skips the scatter plot, so together with export_trials = False no per-trial data is kept at all
+# store is an optional Result_Store.RunWriter for the raw girl counts and the aggregated frequencies
+# cache is an optional Result_Cache.ResultCache, a seeded run then copies its scatter plot from the cache
+def family_simulation(trial_count=None, curve_engine="streaming", rng=None, export_trials=True, store=None,
+                      cache=None, engine="batched", children=3, p_girl=0.5, plot=True, output=None):
 
-    for trial in range(trial_count):
-        children = [random.choice(['B', 'G']) for _ in range(3)]  # Generate children genders
-        girl_count = children.count('G')  # Count the number of girls
-        
-        is_at_least_one_girl = 'G' in children
-        is_all_girls = children == ['G', 'G', 'G']
-
-        # Update counters based on conditions
-        if is_at_least_one_girl:
-            at_least_one_girl += 1
-        if is_all_girls:
-            all_girls += 1
-
-        # Store trial results
-        simulation_results.append({
-            'Trial': trial + 1,
-            'Girl Count': girl_count,
-            'At least one girl': is_at_least_one_girl,
-            'All children are girls': is_all_girls
-        })
+    if trial_count is None:
+        trial_count = int(input("How many trials do you want to run? "))
+    if curve_engine not in ("streaming", "cumsum"):
+        raise ValueError(f"Unknown curve engine '{curve_engine}'. Use 'streaming' or 'cumsum'.")
+
+    keep_trials = export_trials or plot or (store is not None and store.save_raw)
+    curves = None
+
+    with phase("sampling"):
+        if engine == "loop":
+            girl_count_frequency, girl_counts, curves = simulate_families_loop(
+                trial_count, children, p_girl, curve_engine, rng)
+        elif engine in ("batched", "jit"):
+            girl_count_frequency, girl_counts = simulate_families(
+                trial_count, children, p_girl, rng=rng, keep_trials=keep_trials, jit=engine == "jit")
+        else:
+            raise ValueError(f"Unknown engine '{engine}'. Use 'loop', 'batched' or 'jit'.")
+        add_count("samples", trial_count)
+
+    at_least_one_girl = int(trial_count - girl_count_frequency[0])  # Trials with at least one girl
+    all_girls = int(girl_count_frequency[children])  # Trials with all children being girls
 
     # Calculate probabilities
     probability_at_least_one_girl = at_least_one_girl / trial_count
@@ -44,135 +58,272 @@ def family_simulation():
 
     print(f"The probability of all girls given at least one girl is {conditional_probability:.4f}")
 
-    # Prepare data for scatter plot
-    cumulative_at_least_one_girl = [sum([r['At least one girl'] for r in simulation_results[:i+1]]) / (i+1) for i in range(trial_count)]
-    cumulative_all_girls = [sum([r['All children are girls'] for r in simulation_results[:i+1]]) / (i+1) for i in range(trial_count)]
-    cumulative_conditional = [
-        cumulative_all_girls[i] / cumulative_at_least_one_girl[i] if cumulative_at_least_one_girl[i] > 0 else 0
-        for i in range(trial_count)
-    ]
+    low, high = wilson_interval(all_girls, at_least_one_girl)
+    print(f"95% Wilson confidence interval for the conditional probability: [{low:.4f}, {high:.4f}]")
 
-    # Scatter plot for probabilities
-    plt.figure(figsize=(10, 6))
-    plt.scatter(range(1, trial_count + 1),
-        cumulative_at_least_one_girl, label='Pr(At Least One Girl)', color='blue', alpha=0.7)
-    plt.scatter(range(1, trial_count + 1),
-        cumulative_all_girls, label='Pr(All Girls)', color='red', alpha=0.7)
-    plt.scatter(range(1, trial_count + 1),
-        cumulative_conditional, label='Pr(All Girls | At Least One Girl)', color='green', alpha=0.7)
-
-    # Add labels, title, and legend
-    plt.title('Scatter Plot of Probabilities Over Trials')
-    plt.xlabel('Trial Count')
-    plt.ylabel('Probability')
-    plt.legend()
-    plt.tight_layout()
-
-    # Save the plot as an image
-    output_image_path = "./family_simulation_scatterplot.png"
-    if os.path.exists(output_image_path):
-        os.remove(output_image_path)  # Delete the existing file
-    plt.savefig(output_image_path)
-    print(f"Scatter Plot saved to {output_image_path}")
-
-    # =======================================================================================================================
-
-    # Save the workbook
-    output_excel_path = "./Coursework.xlsx"
+    exact_at_least_one_girl, exact_all_girls, exact_conditional = exact_family_probabilities(children, p_girl)
+    print(f"Exact values for {children} children with Pr(Girl) = {p_girl}: "
+          f"Pr(At Least One Girl) = {exact_at_least_one_girl:.4f}, Pr(All Girls) = {exact_all_girls:.4f}, "
+          f"Pr(All Girls | At Least One Girl) = {exact_conditional:.4f}")
 
-    # Check if the file exists
-    if os.path.exists(output_excel_path):
-        # Load the existing workbook
-        wb = load_workbook(output_excel_path)
-        # Check if the sheet already exists
-        if "Family Simulation" in wb.sheetnames:
-            # Remove the existing sheet
-            del wb["Family Simulation"]
-    else:
-        # Create a new workbook
-        wb = Workbook()
-
-    # Create a new sheet
-    ws = wb.create_sheet("Family Simulation")
-
-
-    # Define styles
-    bold_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    center_align = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
+    if store is not None:
+        if store.save_raw:
+            store.append("trials", girl_count=girl_counts)
+        store.append("girl_counts", girl_count=np.arange(girl_count_frequency.size), frequency=girl_count_frequency)
+        store.set_summary(trial_count=trial_count, children=children, p_girl=p_girl,
+                          probability_at_least_one_girl=probability_at_least_one_girl,
+                          probability_all_girls=probability_all_girls, conditional_probability=conditional_probability,
+                          exact_conditional_probability=exact_conditional)
+
+    # The plot only depends on the trials, so a seeded run can copy it from the cache
+    if plot:
+        run_output(
+            output, cached_call,
+            cache, "family plot", {"trial_count": trial_count, "curve_engine": curve_engine, "engine": engine,
+                                   "children": children, "p_girl": p_girl}, rng,
+            lambda: plot_probability_curves(trial_count, girl_counts, children, curves),
+            files=["./family_simulation_scatterplot.png"]
+        )
 
-    # Write the header row
-    ws.merge_cells(start_row=1, start_column=1, end_row=2, end_column=8)
-    cell = ws.cell(row=1, column=1, value="Statistics - Family Simulation Results")
-    ws.row_dimensions[1].height = 20
-    ws.row_dimensions[2].height = 20
-    cell.font = Font(bold=True, color="FFFFFF", size=15)
-    cell.fill = header_fill
-    cell.alignment = center_align
-    cell.border = thin_border
-
-    # Write the headers
-    headers = ["Trial", "Girl Count", "At least one girl", "All children are girls"]
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=5, column=col_num, value=header)
-        cell.font = bold_font
-        cell.fill = header_fill
-        cell.alignment = center_align
-        cell.border = thin_border
-
-     # Adjust column widths
-    column_widths = [10, 12, 20, 20, 5, 5, 30, 15]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[chr(64 + i)].width = width
-
-    # Populate trial data
-    for row_num, result in enumerate(simulation_results, 6):
-        ws.cell(row=row_num, column=1, value=result['Trial']).border = thin_border
-        ws.cell(row=row_num, column=2, value=result['Girl Count']).border = thin_border
-        ws.cell(row=row_num, column=3, value=result['At least one girl']).border = thin_border
-        ws.cell(row=row_num, column=4, value=result['All children are girls']).border = thin_border
-
-    # Write the statistical data section
-    ws.merge_cells(start_row=5, start_column=7, end_row=5, end_column=8)
-    ws.row_dimensions[5].height = 25
-    cell = ws.cell(row=5, column=7, value="Statistical Values")
-    cell.font = bold_font
-    cell.fill = header_fill
-    cell.alignment = center_align
-    cell.border = thin_border
+    run_output(output, export_family_results, trial_count, children, p_girl, girl_count_frequency,
+               girl_counts if export_trials else None,
+               (probability_at_least_one_girl, probability_all_girls, conditional_probability),
+               (exact_at_least_one_girl, exact_all_girls, exact_conditional))
+
+    return probability_at_least_one_girl, probability_all_girls, conditional_probability
+
+# Save the raw trials (when given) to their own streamed workbook and the summary to the coursework workbook.
+# probabilities and exact_probabilities are (at least one girl, all girls, all girls given at least one girl)
+def export_family_results(trial_count, children, p_girl, girl_count_frequency, girl_counts, probabilities,
+                          exact_probabilities):
+    probability_at_least_one_girl, probability_all_girls, conditional_probability = probabilities
+    exact_at_least_one_girl, exact_all_girls, exact_conditional = exact_probabilities
+    output_excel_path = "./Coursework.xlsx"
 
     stat_headers = [
         "Trial Count",
+        "Number of Children",
+        "Probability of a Girl",
         "Probability of At Least One Girl",
-        "Probability of All Girls", 
-        "Conditional Probability"
+        "Probability of All Girls",
+        "Conditional Probability",
+        "Exact Probability of At Least One Girl",
+        "Exact Probability of All Girls",
+        "Exact Conditional Probability",
     ]
 
-    for row_num, header in enumerate(stat_headers, 6):
-        cell = ws.cell(row=row_num, column=7, value=header)
-        cell.border = thin_border
-
     values = [
         trial_count,
+        children,
+        p_girl,
         probability_at_least_one_girl,
-        probability_all_girls, 
+        probability_all_girls,
         conditional_probability,
+        exact_at_least_one_girl,
+        exact_all_girls,
+        exact_conditional,
     ]
 
-    for row_num, value in enumerate(values, 6):
-        cell = ws.cell(row=row_num, column=8, value=value)
-        cell.border = thin_border
+    if girl_counts is not None:
+        output_trials_path = "./Family_Simulation_Trials.xlsx"
+        write_trials_workbook(
+            output_trials_path, "Family Simulation",
+            ["Trial", "Girl Count", "At least one girl", "All children are girls"],
+            ((trial + 1, girl_count, girl_count > 0, girl_count == children)
+             for trial, girl_count in enumerate(girl_counts.tolist())),
+            column_widths=[10, 12, 20, 20]
+        )
+        stat_headers.append("Trial Records")
+        values.append(output_trials_path)
+
+    write_summary_sheet(
+        output_excel_path, "Family Simulation", "Statistics - Family Simulation Results",
+        ["Girl Count", "Frequency"], list(enumerate(girl_count_frequency.tolist())),
+        stat_headers, values
+    )
+
+# Exact binomial reference values: (Pr(at least one girl), Pr(all girls), Pr(all girls | at least one girl))
+def exact_family_probabilities(children=3, p_girl=0.5):
+    all_girls = p_girl ** children
+    at_least_one_girl = 1 - (1 - p_girl) ** children
+    conditional = all_girls / at_least_one_girl if at_least_one_girl > 0 else 0
+    return at_least_one_girl, all_girls, conditional
+
+def check_family_parameters(children, p_girl):
+    if children < 1:
+        raise ValueError(f"A family needs at least one child, got {children}.")
+    if not 0 <= p_girl <= 1:
+        raise ValueError(f"The girl probability must be between 0 and 1, got {p_girl}.")
+
+# Original child-by-child loop, returns (girl_count_frequency, girl_counts, curves)
+# curves holds the three streaming convergence curves, or None with curve_engine = "cumsum"
+def simulate_families_loop(trial_count, children=3, p_girl=0.5, curve_engine="streaming", rng=None):
+    check_family_parameters(children, p_girl)
+    if p_girl != 0.5:
+        raise ValueError("The loop engine only samples p_girl = 0.5, use the batched engine.")
+    rng = as_python_random(rng)
+
+    girl_count_frequency = np.zeros(children + 1, dtype=np.int64)  # Number of trials with 0, 1, ... girls
+    girl_counts = np.empty(trial_count, dtype=np.min_scalar_type(children))  # Girl count of each trial
+
+    # Running statistics for the convergence curves, the conditional one only sees trials with at least one girl
+    at_least_one_girl_stats = RunningStatistics()
+    all_girls_stats = RunningStatistics()
+    conditional_stats = RunningStatistics()
+    cumulative_at_least_one_girl = []
+    cumulative_all_girls = []
+    cumulative_conditional = []
+
+    for trial in range(trial_count):
+        genders = [rng.choice(['B', 'G']) for _ in range(children)]  # Generate children genders
+        girl_count = genders.count('G')  # Count the number of girls
+        girl_count_frequency[girl_count] += 1
+        girl_counts[trial] = girl_count
+
+        if curve_engine == "streaming":
+            is_at_least_one_girl = girl_count > 0
+            is_all_girls = girl_count == children
+            at_least_one_girl_stats.update(is_at_least_one_girl)
+            all_girls_stats.update(is_all_girls)
+            if is_at_least_one_girl:
+                conditional_stats.update(is_all_girls)
+
+            cumulative_at_least_one_girl.append(at_least_one_girl_stats.mean)
+            cumulative_all_girls.append(all_girls_stats.mean)
+            cumulative_conditional.append(conditional_stats.mean)
+
+    curves = None
+    if curve_engine == "streaming":
+        curves = (cumulative_at_least_one_girl, cumulative_all_girls, cumulative_conditional)
+    return girl_count_frequency, girl_counts, curves
+
+# Sample the families a chunk at a time and count the girls with array reductions.
+# Returns (girl_count_frequency, girl_counts), girl_counts is None unless keep_trials.
+# With an RngProvider every chunk draws from its own child stream, like the batched dice engine
+# jit = True counts the girls with sample_girl_counts_jit instead
+def simulate_families(trial_count, children=3, p_girl=0.5, chunk_size=None, rng=None, keep_trials=False, jit=False):
+    check_family_parameters(children, p_girl)
+    rng_provider = rng if isinstance(rng, RngProvider) else None
+    if rng_provider is None:
+        rng = as_generator(rng)
+    chunk_size = chunk_size or FAMILY_CHUNK_SIZE
+
+    girl_count_frequency = np.zeros(children + 1, dtype=np.int64)
+    girl_counts = np.empty(trial_count, dtype=np.min_scalar_type(children)) if keep_trials else None
+
+    completed = 0
+    while completed < trial_count:
+        size = min(chunk_size, trial_count - completed)
+        chunk_rng = rng_provider.generator(completed // chunk_size) if rng_provider is not None else rng
+        if jit:
+            counts = sample_girl_counts_jit(size, children, p_girl, chunk_rng)
+        else:
+            counts = sample_girl_counts(size, children, p_girl, chunk_rng)
+        girl_count_frequency += girl_count_histogram(counts, children)
+
+        if keep_trials:
+            girl_counts[completed:completed + size] = counts
+        completed += size
+
+    return girl_count_frequency, girl_counts
+
+# Number of families with 0, 1, ... children girls. For small families one equality count per girl count is several
+# times faster than np.bincount, which first converts the uint8 counts to a 64-bit index array
+def girl_count_histogram(counts, children):
+    if children < 16:
+        return np.array([np.count_nonzero(counts == girls) for girls in range(children + 1)], dtype=np.int64)
+    return np.bincount(counts, minlength=children + 1)
+
+# Girl count of size families.
+# With p_girl = 0.5 every bit of a 64-bit random word (Rng_Provider.random_words) is a fair child, so a word holds
+# 64 // children families: each family is a children-bit field and its girl count is the popcount of that field.
+# Any other p_girl compares a (children, size) matrix of 32-bit uniforms with p_girl * 2**32 (a resolution of
+# 2**-32 on p_girl) and adds up the boolean rows, one row per child
+def sample_girl_counts(size, children, p_girl, rng):
+    dtype = np.min_scalar_type(children)
+    if p_girl == 0.5 and children <= 64:
+        families_per_word = 64 // children
+        words = random_words(rng, -(-size // families_per_word))
+        mask = np.uint64((1 << children) - 1)
 
-    # Save the workbook after all data is written
-    wb.save(output_excel_path)
-    print(f"Excel file saved to {output_excel_path}")
+        counts = np.empty((families_per_word, words.size), dtype=np.uint8)
+        field_bits = np.empty_like(words)
+        for field in range(families_per_word):
+            np.right_shift(words, np.uint64(field * children), out=field_bits)
+            np.bitwise_and(field_bits, mask, out=field_bits)
+            popcount(field_bits, counts[field])
+        return counts.reshape(-1)[:size]
+    if p_girl == 1:
+        return np.full(size, children, dtype=dtype)
+
+    threshold = np.uint32(int(p_girl * 2**32))
+    uniforms = random_uint32(rng, children * size)
+    counts = np.zeros(size, dtype=dtype)
+    for child in uniforms.reshape(children, size):
+        counts += child < threshold
+    return counts
+
+# Number of set bits of every uint64 in words, written to the uint8 array out.
+# np.bitwise_count on NumPy 2.0 and later, a byte lookup table on older versions
+def popcount(words, out):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words, out=out)
+    return np.sum(BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.size, 8), axis=1, dtype=np.uint8, out=out)
+
+# Girl count of size families with the Jit_Kernels kernels, for any p_girl. Draws the same random words as
+# sample_girl_counts: 64-bit words split into families at p_girl = 0.5, otherwise a (children, size) matrix of
+# 32-bit uniforms, so a seed gives the same counts on both engines
+def sample_girl_counts_jit(size, children, p_girl, rng):
+    from Jit_Kernels import family_girl_counts, family_popcount_counts
+    if p_girl == 0.5 and children <= 64:
+        words = random_words(rng, -(-size // (64 // children)))
+        return family_popcount_counts(words, children, size)
+    threshold = min(int(p_girl * 2**32), 2**32)  # p_girl = 1 makes every child a girl
+    uniforms = random_uint32(rng, children * size)
+    return family_girl_counts(uniforms.reshape(children, size), np.int64(threshold))
+
+
+# Scatter plot of the three probability curves over the trials.
+# Without precomputed (streaming) curves they are built here with a cumsum over the girl counts
+def plot_probability_curves(trial_count, girl_counts, children, curves=None):
+    with phase("plotting"), PLOT_LOCK:
+        plt = pyplot()
+
+        # Prepare data for scatter plot
+        if curves is None:
+            cumulative_at_least_one_girl = cumulative_proportions(girl_counts > 0)
+            cumulative_all_girls = cumulative_proportions(girl_counts == children)
+            cumulative_conditional = np.divide(
+                cumulative_all_girls, cumulative_at_least_one_girl,
+                out=np.zeros(trial_count), where=cumulative_at_least_one_girl > 0
+            )
+        else:
+            cumulative_at_least_one_girl, cumulative_all_girls, cumulative_conditional = curves
+
+        # Scatter plot for probabilities
+        plt.figure(figsize=(10, 6))
+        plt.scatter(range(1, trial_count + 1),
+            cumulative_at_least_one_girl, label='Pr(At Least One Girl)', color='blue', alpha=0.7)
+        plt.scatter(range(1, trial_count + 1),
+            cumulative_all_girls, label='Pr(All Girls)', color='red', alpha=0.7)
+        plt.scatter(range(1, trial_count + 1),
+            cumulative_conditional, label='Pr(All Girls | At Least One Girl)', color='green', alpha=0.7)
+
+        # Add labels, title, and legend
+        plt.title('Scatter Plot of Probabilities Over Trials')
+        plt.xlabel('Trial Count')
+        plt.ylabel('Probability')
+        plt.legend()
+        plt.tight_layout()
+
+        # Save the plot as an image
+        output_image_path = "./family_simulation_scatterplot.png"
+        if os.path.exists(output_image_path):
+            os.remove(output_image_path)  # Delete the existing file
+        plt.savefig(output_image_path)
+        plt.close()
+        print(f"Scatter Plot saved to {output_image_path}")
 
 
 if __name__ == '__main__':
-    family_simulation()
\ No newline at end of file
+    family_simulation()
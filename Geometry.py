@@ -0,0 +1,94 @@
+import numpy as np
+
+
+# Target shapes for the marble drops. Every shape has a bounding_box (x_min, x_max, y_min, y_max)
+# and a vectorised contains(x, y) returning a boolean array
+
+# Circle with centre (centre_x, centre_y), the boundary counts as inside
+class Circle:
+
+    def __init__(self, centre_x, centre_y, radius):
+        self.centre_x = centre_x
+        self.centre_y = centre_y
+        self.radius = radius
+        self.bounding_box = (centre_x - radius, centre_x + radius, centre_y - radius, centre_y + radius)
+
+    def contains(self, x, y):
+        return (x - self.centre_x)**2 + (y - self.centre_y)**2 <= self.radius**2
+
+
+# Axis-aligned rectangle, the boundary counts as outside (x_min < x < x_max, y_min < y < y_max)
+class Rectangle:
+
+    def __init__(self, x_min, x_max, y_min, y_max):
+        self.bounding_box = (x_min, x_max, y_min, y_max)
+
+    def contains(self, x, y):
+        x_min, x_max, y_min, y_max = self.bounding_box
+        return (x > x_min) & (x < x_max) & (y > y_min) & (y < y_max)
+
+
+# Simple polygon given by its vertices in order, tested with the even-odd ray casting rule
+class Polygon:
+
+    def __init__(self, vertices):
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        if self.vertices.ndim != 2 or self.vertices.shape[0] < 3 or self.vertices.shape[1] != 2:
+            raise ValueError("A polygon needs at least three (x, y) vertices.")
+        x_values, y_values = self.vertices[:, 0], self.vertices[:, 1]
+        self.bounding_box = (x_values.min(), x_values.max(), y_values.min(), y_values.max())
+
+    def contains(self, x, y):
+        inside = np.zeros(np.shape(x), dtype=bool)
+        for (x1, y1), (x2, y2) in zip(self.vertices, np.roll(self.vertices, -1, axis=0)):
+            if y1 == y2:
+                continue  # A horizontal edge is never crossed by a horizontal ray
+            crosses_edge = (y1 > y) != (y2 > y)
+            crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= crosses_edge & (x < crossing_x)
+        return inside
+
+
+# Drop area and target shapes of the pi experiment
+DROP_AREA = (-2, 4, -2, 2)
+UNIT_CIRCLE = Circle(0, 0, 1)
+UNIT_SQUARE = Rectangle(2, 3, -0.5, 0.5)
+
+
+# Classify points against shapes, a point belongs to the first shape (in list order) that contains it.
+# Returns the count per shape followed by the count of points outside every shape.
+# With return_indices = True it also returns the matching point indices per region, in the same order
+def classify_points(x, y, shapes, return_indices=False):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Points not claimed by a shape yet
+    remaining = np.arange(x.size)
+    remaining_x = x
+    remaining_y = y
+
+    counts = []
+    indices = []
+    for shape in shapes:
+        # Bounding box pre-rejection, the exact test only runs on points inside the box
+        x_min, x_max, y_min, y_max = shape.bounding_box
+        in_box = np.flatnonzero(
+            (remaining_x >= x_min) & (remaining_x <= x_max) & (remaining_y >= y_min) & (remaining_y <= y_max)
+        )
+        hits = in_box[shape.contains(remaining_x[in_box], remaining_y[in_box])]
+
+        counts.append(int(hits.size))
+        if return_indices:
+            indices.append(remaining[hits])
+
+        unclaimed = np.ones(remaining.size, dtype=bool)
+        unclaimed[hits] = False
+        remaining = remaining[unclaimed]
+        remaining_x = remaining_x[unclaimed]
+        remaining_y = remaining_y[unclaimed]
+
+    counts.append(int(remaining.size))
+    if return_indices:
+        indices.append(remaining)
+        return counts, indices
+    return counts
@@ -0,0 +1,152 @@
+import cProfile
+import functools
+import json
+import os  # Required for file operations
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight per-phase timers and counters. Everything is a no-op until enable() is called,
+# so the simulations can stay instrumented at almost no cost.
+# Phases may also run on background threads (Output_Pipeline): every thread has its own phase stack,
+# and only the main thread collects cProfile data
+
+_enabled = False
+_profile_phases = False
+_phases = {}  # name -> {"calls", "seconds", "counters"}
+_threads = threading.local()  # _threads.phase_stack: names of the thread's running phases, innermost last
+_lock = threading.Lock()
+_profiles = {}  # name -> cProfile.Profile
+_active_profile = None
+_start_time = None
+
+
+def enable(profile=False):
+    global _enabled, _profile_phases, _start_time
+    _enabled = True
+    _profile_phases = profile
+    _start_time = time.perf_counter()
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    global _start_time, _active_profile
+    _phases.clear()
+    _phase_stack().clear()
+    _profiles.clear()
+    _active_profile = None
+    _start_time = time.perf_counter() if _enabled else None
+
+def _phase_stack():
+    if not hasattr(_threads, "phase_stack"):
+        _threads.phase_stack = []
+    return _threads.phase_stack
+
+def _phase_record(name):
+    return _phases.setdefault(name, {"calls": 0, "seconds": 0.0, "counters": {}})
+
+
+# Time a block of code as one phase, e.g. with phase("plotting"): ...
+# With profiling enabled, the outermost phase also collects a cProfile of the block
+@contextmanager
+def phase(name):
+    global _active_profile
+    if not _enabled:
+        yield
+        return
+
+    profile = None
+    if _profile_phases and _active_profile is None and threading.current_thread() is threading.main_thread():
+        profile = _profiles.setdefault(name, cProfile.Profile())
+        _active_profile = profile
+        profile.enable()
+
+    _phase_stack().append(name)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        _phase_stack().pop()
+        with _lock:
+            record = _phase_record(name)
+            record["calls"] += 1
+            record["seconds"] += elapsed
+        if profile is not None:
+            profile.disable()
+            _active_profile = None
+
+# Decorator form of phase(), the phase name defaults to the function name
+def timed(name=None):
+    def decorator(function):
+        phase_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with phase(phase_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Add to a counter (samples generated, rows written, ...) of the innermost running phase
+def add_count(counter, amount=1):
+    if not _enabled:
+        return
+    stack = _phase_stack()
+    with _lock:
+        record = _phase_record(stack[-1] if stack else "unphased")
+        record["counters"][counter] = record["counters"].get(counter, 0) + amount
+
+
+# Peak resident memory of this process in bytes, None where the resource module is missing (Windows)
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports kilobytes
+
+def report_dict():
+    wall_time = time.perf_counter() - _start_time if _start_time is not None else 0.0
+    phases = {}
+    for name, record in _phases.items():
+        throughput = {counter: value / record["seconds"] for counter, value in record["counters"].items()
+                      if record["seconds"] > 0}
+        phases[name] = {
+            "calls": record["calls"],
+            "seconds": record["seconds"],
+            "share_of_wall_time": record["seconds"] / wall_time if wall_time > 0 else None,
+            "counters": dict(record["counters"]),
+            "per_second": throughput,
+        }
+    return {"wall_time": wall_time, "peak_rss_bytes": peak_rss_bytes(), "phases": phases}
+
+def report_text():
+    report = report_dict()
+    lines = ["", "Run Report:", f"{'Phase':<22}{'Calls':>7}{'Time (s)':>11}{'Share':>8}  Throughput"]
+    for name, record in report["phases"].items():
+        share = f"{record['share_of_wall_time']:.1%}" if record["share_of_wall_time"] is not None else ""
+        throughput = ", ".join(f"{value:,.0f} {counter}/s" for counter, value in record["per_second"].items())
+        lines.append(f"{name:<22}{record['calls']:>7}{record['seconds']:>11.3f}{share:>8}  {throughput}")
+    lines.append(f"Wall time: {report['wall_time']:.3f} s")
+    if report["peak_rss_bytes"] is not None:
+        lines.append(f"Peak RSS: {report['peak_rss_bytes'] / 2**20:.1f} MiB")
+    return "\n".join(lines)
+
+# Save the JSON report, and one .prof file per profiled phase next to it (open them with pstats or snakeviz)
+def save_report(path):
+    with open(path, "w") as file:
+        json.dump(report_dict(), file, indent=2)
+
+    base_path = os.path.splitext(path)[0]
+    for name, profile in _profiles.items():
+        profile.dump_stats(f"{base_path}.{name.replace(' ', '_')}.prof")
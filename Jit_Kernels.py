@@ -0,0 +1,96 @@
+import importlib.util
+import numpy as np
+
+# Per-sample kernels of the "jit" engines. With numba installed every kernel is compiled with @njit (parallel prange
+# loops, compiled code cached on disk next to this file so warm starts skip compilation). Without numba the same
+# functions run as plain Python loops, so the results never depend on which backend ran them.
+# The kernels take random numbers drawn by the caller from its numpy Generator, so a seed gives the same draws
+# (and the same statistics) on both backends
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+
+if NUMBA_AVAILABLE:
+    from numba import njit, prange
+
+    def jit_kernel(function):
+        return njit(parallel=True, cache=True)(function)
+else:
+    prange = range
+
+    def jit_kernel(function):
+        return function
+
+
+# "numba" or "python", the backend the kernels run on
+def jit_backend():
+    return "numba" if NUMBA_AVAILABLE else "python"
+
+# The interpreted version of a kernel, for comparing the two backends
+def python_kernel(kernel):
+    return getattr(kernel, "py_func", kernel)
+
+
+# Count the marbles in the square and in the circle of the pi experiment, the square is tested first
+# like the original scalar loop. Returns (circle_hits, square_hits)
+@jit_kernel
+def count_marble_hits(x, y):
+    circle_hits = 0
+    square_hits = 0
+    for i in prange(x.size):
+        if 2 < x[i] < 3 and -0.5 < y[i] < 0.5:
+            square_hits += 1
+        elif x[i] * x[i] + y[i] * y[i] <= 1:
+            circle_hits += 1
+    return circle_hits, square_hits
+
+# Region of every marble in the Geometry.classify_points order: 0 rectangle, 1 circle, 2 out of bounds
+@jit_kernel
+def classify_marbles(x, y):
+    regions = np.empty(x.size, dtype=np.uint8)
+    for i in prange(x.size):
+        if 2 < x[i] < 3 and -0.5 < y[i] < 0.5:
+            regions[i] = 0
+        elif x[i] * x[i] + y[i] * y[i] <= 1:
+            regions[i] = 1
+        else:
+            regions[i] = 2
+    return regions
+
+# Sum of every row of a (trials, num_dice) matrix of dice rolls
+@jit_kernel
+def dice_sums(rolls):
+    sums = np.empty(rolls.shape[0], dtype=np.int64)
+    for trial in prange(rolls.shape[0]):
+        total = 0
+        for die in range(rolls.shape[1]):
+            total += rolls[trial, die]
+        sums[trial] = total
+    return sums
+
+# Girl count of every family from a (children, families) matrix of raw 32-bit uniforms:
+# a child is a girl when its uniform is below threshold = p_girl * 2**32
+@jit_kernel
+def family_girl_counts(uniforms, threshold):
+    counts = np.empty(uniforms.shape[1], dtype=np.int64)
+    for family in prange(uniforms.shape[1]):
+        girls = 0
+        for child in range(uniforms.shape[0]):
+            if uniforms[child, family] < threshold:
+                girls += 1
+        counts[family] = girls
+    return counts
+
+# Girl count of size families from raw 64-bit words at p_girl = 0.5, in the layout of the popcount path of
+# Family_Simulation.sample_girl_counts: family i is the children-bit field i // words.size of word i % words.size
+@jit_kernel
+def family_popcount_counts(words, children, size):
+    counts = np.empty(size, dtype=np.int64)
+    mask = np.uint64((1 << children) - 1)
+    for family in prange(size):
+        field = family // words.size
+        bits = (words[family % words.size] >> np.uint64(field * children)) & mask
+        girls = 0
+        while bits:
+            bits &= bits - np.uint64(1)
+            girls += 1
+        counts[family] = girls
+    return counts
@@ -1,14 +1,19 @@
+import argparse
+import sys
 from statistics import mean
-import matplotlib
-matplotlib.use('Agg')  # Non-GUI backend for matplotlib
 
-import Dice_Simulation as DicePyFile
-import Family_Simulation as FamilyPyFile
-import Marbles_Drop_Simulation as MarblesPyFile
-import Monte_Carlo_Simulation as MontePyFile
+# The simulation modules (and numpy) are imported when their option runs, so the menu and the command line start
+# quickly. The argument parser only needs the names in Defaults
+import Instrumentation
+from Checkpoint import CHECKPOINT_INTERVAL, Checkpoint, read_checkpoint
+from Defaults import BIT_GENERATOR_NAMES, CACHE_DIR, MAX_CACHE_BYTES, RESULTS_DIR, SAMPLER_NAMES
+from Output_Pipeline import OutputPipeline
 
 #Main function to run the script
+# The plots and workbooks of a run are written in the background, so the menu is back while they are saved.
+# A plot or export that failed in the meantime is reported before the next prompt
 def Main():
+    output = OutputPipeline()
     while True:
         print("\n=============================== Group C Coursework ===============================\n")
         print("1. Run Monte Carlo Simulation")
@@ -18,28 +23,310 @@ def Main():
         print("--------------------------------------------------------")
         
         try:
+            output.check_errors()
             choice = int(input("Please choose an option (1-4): "))
             print("--------------------------------------------------------\n")
             
             if choice == 1:
-                MontePyFile.Monte_Carlo_Simulation()
+                import Monte_Carlo_Simulation as MontePyFile
+                MontePyFile.Monte_Carlo_Simulation(output=output)
             elif choice == 2:
                 print("Please wait...")
-                DicePyFile.dice_simulation_Main()
+                import Dice_Simulation as DicePyFile
+                DicePyFile.dice_simulation_Main(output=output)
             elif choice == 3:
-                FamilyPyFile.familySimulation_Main()
+                import Family_Simulation as FamilyPyFile
+                FamilyPyFile.familySimulation_Main(output=output)
             elif choice == 4:
+                print("Waiting for the plots and Excel files to be saved...")
+                try:
+                    output.close()
+                except RuntimeError as error:
+                    print(f"{error}. See the error above.")
                 print("Closing the program. Goodbye!")
                 break
             else:
                 print("Invalid choice. Please enter a number between 1 and 4.")
         except ValueError:
             print("Invalid input. Please enter a valid number.")
+        except RuntimeError as error:
+            print(f"{error}. See the error above.")
 
+# Parse a positive count, accepting scientific notation such as 1e6
+def positive_count(text):
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a number")
+    if value < 1 or value != int(value):
+        raise argparse.ArgumentTypeError(f"'{text}' is not a positive whole number")
+    return int(value)
 
-# Call Main() to run the script
+# Command line interface so the simulations can run from scripts and batch jobs without prompts
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="Main.py",
+        description="Group C Coursework simulations. Run without arguments for the interactive menu."
+    )
+    parser.add_argument("--report", metavar="PATH", default=None,
+                        help="Print a per-phase timing report at the end of the run and save it as JSON")
+    parser.add_argument("--profile", action="store_true",
+                        help="Also capture a cProfile of each phase, saved next to the --report file")
+    parser.add_argument("--bit-generator", choices=BIT_GENERATOR_NAMES, default="PCG64",
+                        help="numpy bit generator behind every random stream (default: PCG64)")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse the results and images of identical seeded runs from an on-disk cache")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help=f"Folder of the result cache (default: {CACHE_DIR})")
+    parser.add_argument("--cache-size", type=float, default=MAX_CACHE_BYTES / 2**20,
+                        help=f"Size limit of the result cache in MiB (default: {MAX_CACHE_BYTES // 2**20})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pi_parser = subparsers.add_parser("pi", help="Estimate Pi with the Monte Carlo simulation")
+    pi_parser.add_argument("--trials", type=positive_count, nargs="+", default=[1000, 10000, 100000, 1000000],
+                           help="Sample sizes to run (default: 1e3 1e4 1e5 1e6)")
+    pi_parser.add_argument("--log-trials", type=positive_count, nargs=3, default=None,
+                           metavar=("SMALLEST", "LARGEST", "COUNT"),
+                           help="Run COUNT log-spaced sample sizes from SMALLEST to LARGEST instead of --trials")
+    pi_parser.add_argument("--sweep", action="store_true",
+                           help="Draw one stream per experiment up to the largest sample size and read the smaller "
+                                "sample sizes off its prefix")
+    pi_parser.add_argument("--experiments", type=positive_count, required=True,
+                           help="Number of experiments for each sample size")
+    pi_parser.add_argument("--workers", type=positive_count, default=1, help="Number of worker processes")
+    pi_parser.add_argument("--seed", type=int, default=None, help="Seed for a reproducible run")
+    pi_parser.add_argument("--engine", choices=["scalar", "numpy", "jit"], default="numpy")
+    pi_parser.add_argument("--sampler", choices=SAMPLER_NAMES, default="uniform",
+                           help="Point sampler of the numpy engine (default: uniform)")
+    pi_parser.add_argument("--plot", action="store_true", help="Save the Pi estimate plot")
+    pi_parser.add_argument("--excel", action="store_true", help="Save the results to Coursework.xlsx")
+    pi_parser.add_argument("--marbles", type=positive_count, default=None,
+                           help="Also save the marble dropping image with this many marbles")
+    pi_parser.add_argument("--marbles-render", choices=["scatter", "density"], default="scatter",
+                           help="Draw every marble, or a fixed-resolution density image for large counts")
+
+    samplers_parser = subparsers.add_parser("samplers", help="Compare the variance of the Pi samplers")
+    samplers_parser.add_argument("--trials", type=positive_count, default=100000)
+    samplers_parser.add_argument("--replications", type=positive_count, default=20)
+    samplers_parser.add_argument("--samplers", choices=SAMPLER_NAMES, nargs="+", default=None)
+    samplers_parser.add_argument("--seed", type=int, default=None)
+
+    adaptive_parser = subparsers.add_parser("adaptive", help="Estimate Pi until a target precision is reached")
+    adaptive_parser.add_argument("--target-se", type=float, default=None, help="Target standard error of Pi")
+    adaptive_parser.add_argument("--target-ci-width", type=float, default=None,
+                                 help="Target width of the 95%% confidence interval of Pi")
+    adaptive_parser.add_argument("--batch-size", type=positive_count, default=100000)
+    adaptive_parser.add_argument("--max-samples", type=positive_count, default=10**9)
+    adaptive_parser.add_argument("--max-seconds", type=float, default=None)
+    adaptive_parser.add_argument("--sampler", choices=SAMPLER_NAMES, default="uniform")
+    adaptive_parser.add_argument("--seed", type=int, default=None)
+
+    dice_parser = subparsers.add_parser("dice", help="Run the dice simulation")
+    dice_parser.add_argument("--trials", type=positive_count, required=True)
+    dice_parser.add_argument("--seed", type=int, default=None)
+    dice_parser.add_argument("--engine", choices=["loop", "batched", "jit"], default="batched")
+    dice_parser.add_argument("--keep-trials", action="store_true",
+                             help="Write every trial to the Excel sheet (memory grows with the trial count)")
+
+    for subparser in (adaptive_parser, dice_parser):
+        subparser.add_argument("--progress", action="store_true",
+                               help="Show the running estimate, its error and the samples/sec after every batch")
+
+    family_parser = subparsers.add_parser("family", help="Run the family simulation")
+    family_parser.add_argument("--trials", type=positive_count, required=True)
+    family_parser.add_argument("--seed", type=int, default=None)
+    family_parser.add_argument("--curve-engine", choices=["streaming", "cumsum"], default="streaming")
+    family_parser.add_argument("--engine", choices=["loop", "batched", "jit"], default="batched")
+    family_parser.add_argument("--children", type=positive_count, default=3, help="Children per family (default: 3)")
+    family_parser.add_argument("--p-girl", type=float, default=0.5,
+                               help="Probability that a child is a girl (default: 0.5)")
+    family_parser.add_argument("--no-plot", action="store_true", help="Skip the scatter plot")
+    family_parser.add_argument("--no-trial-records", action="store_true",
+                               help="Only write the summary to Excel, not one row per trial")
+
+    marbles_parser = subparsers.add_parser("marbles", help="Save the marble dropping areas image")
+    marbles_parser.add_argument("--count", type=positive_count, required=True)
+    marbles_parser.add_argument("--seed", type=int, default=None)
+    marbles_parser.add_argument("--render", choices=["scatter", "density"], default="scatter",
+                                help="Draw every marble, or a fixed-resolution density image for large counts")
+    marbles_parser.add_argument("--engine", choices=["numpy", "jit"], default="numpy",
+                                help="Classify the scatter marbles with array operations or the jit kernel")
+
+    # Result store options shared by every simulation
+    for subparser in (pi_parser, dice_parser, family_parser):
+        subparser.add_argument("--store", action="store_true",
+                               help="Save the raw and aggregated results as a columnar run (.npy batches)")
+        subparser.add_argument("--store-dir", default=RESULTS_DIR, help=f"Folder for stored runs (default: {RESULTS_DIR})")
+        subparser.add_argument("--store-summary-only", action="store_true",
+                               help="Store only the aggregated results, not every raw sample")
+
+    for subparser in (pi_parser, dice_parser):
+        subparser.add_argument("--checkpoint", metavar="PATH", default=None,
+                               help="Save the progress to this file periodically (default with --resume: "
+                                    "<command>_checkpoint.json)")
+        subparser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                               help=f"Seconds between checkpoint saves (default: {CHECKPOINT_INTERVAL:g})")
+        subparser.add_argument("--resume", action="store_true",
+                               help="Continue an interrupted run from its checkpoint, with its seed")
+
+    # Distributed execution options of the pi and dice simulations
+    for subparser in (pi_parser, dice_parser):
+        subparser.add_argument("--listen", type=host_port, metavar="HOST:PORT", default=None,
+                               help="Run the simulation as shards on workers that connect to this address "
+                                    "(see the worker command)")
+        subparser.add_argument("--local-workers", type=int, default=0,
+                               help="Run the shards on this many local worker processes over sockets")
+
+    worker_parser = subparsers.add_parser("worker", help="Run shards for a distributed pi or dice run")
+    worker_parser.add_argument("--connect", type=host_port, metavar="HOST:PORT", required=True,
+                               help="Address the coordinator listens on")
+    worker_parser.add_argument("--retry-seconds", type=float, default=60,
+                               help="Keep trying to connect for this long while the coordinator is not up (default: 60)")
+
+    return parser
+
+# Checkpoint for the run described by the command line arguments, or None when checkpointing is off
+def make_checkpoint(args):
+    if not getattr(args, "checkpoint", None) and not getattr(args, "resume", False):
+        return None
+    path = args.checkpoint or f"{args.command}_checkpoint.json"
+    return Checkpoint(path, args.checkpoint_interval, resume=args.resume)
+
+# Result store for the run described by the command line arguments, or None when --store is not given
+# seed is the entropy of the run's RngProvider, so unseeded runs are recorded reproducibly too
+def make_store(args, seed=None):
+    if not args.store:
+        return None
+
+    parameters = {key: value for key, value in vars(args).items()
+                  if key not in ("command", "seed", "store", "store_dir", "store_summary_only")}
+    from Result_Store import RunWriter
+    store = RunWriter(args.command, parameters, seed, root=args.store_dir, save_raw=not args.store_summary_only)
+    print(f"Storing results as run '{store.run_id}' in {args.store_dir}")
+    return store
+
+# Parse a host:port address
+def host_port(text):
+    host, _, port = text.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"'{text}' is not a host:port address")
+    return host, int(port)
+
+# Distributed.Coordinator for the run described by the command line arguments,
+# or None when neither --listen nor --local-workers is given
+def make_coordinator(args):
+    if getattr(args, "listen", None) is None and not getattr(args, "local_workers", 0):
+        return None
+    from Distributed import DEFAULT_ADDRESS, Coordinator
+    try:
+        return Coordinator(args.listen or DEFAULT_ADDRESS, local_workers=args.local_workers)
+    except ValueError as error:
+        build_parser().error(str(error))
+
+# Run one simulation from command line arguments
+def run_cli(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.report or args.profile:
+        Instrumentation.enable(profile=args.profile)
+    try:
+        run_command(args)
+    finally:
+        if Instrumentation.is_enabled():
+            print(Instrumentation.report_text())
+            report_path = args.report or "run_report.json"
+            Instrumentation.save_report(report_path)
+            print(f"Run report saved to {report_path}")
+
+# Run the simulation selected on the command line
+# Every simulation draws from one RngProvider, its seed is printed so an unseeded run can be repeated with --seed
+def run_command(args):
+    if args.command == "worker":
+        from Distributed import check_authkey, DEFAULT_AUTHKEY, run_worker
+        try:
+            check_authkey(args.connect, DEFAULT_AUTHKEY)
+        except ValueError as error:
+            build_parser().error(str(error))
+        print(f"Worker connecting to {args.connect[0]}:{args.connect[1]}")
+        run_worker(args.connect, retry_seconds=args.retry_seconds)
+        return
+
+    checkpoint = make_checkpoint(args)
+    seed = getattr(args, "seed", None)
+    saved = read_checkpoint(checkpoint.path) if checkpoint is not None and checkpoint.resume else None
+    if saved is not None and seed is None:
+        # Continue with the seed and bit generator of the interrupted run
+        seed = saved["parameters"]["seed"]
+        args.bit_generator = saved["parameters"]["bit_generator"] or args.bit_generator
+
+    from Result_Cache import ResultCache
+    from Rng_Provider import RngProvider
+    rng_provider = RngProvider(seed, args.bit_generator)
+    if seed is None:
+        print(f"Random seed: {rng_provider.seed}")
+
+    # Only seeded runs can repeat, so only they go through the cache
+    cache = ResultCache(args.cache_dir, int(args.cache_size * 2**20)) if args.cache and seed is not None else None
+
+    if args.command in ("pi", "adaptive", "samplers"):
+        import Monte_Carlo_Simulation as MontePyFile
+    elif args.command == "dice":
+        import Dice_Simulation as DicePyFile
+    elif args.command == "family":
+        import Family_Simulation as FamilyPyFile
+    elif args.command == "marbles":
+        import Marbles_Drop_Simulation as MarblesPyFile
+
+    if args.command == "pi":
+        MontePyFile.Monte_Carlo_Simulation(
+            experiments_count=args.experiments,
+            show_graph=args.plot,
+            save_to_excel_flag=args.excel,
+            save_marble_dropping_image=args.marbles is not None,
+            marble_count=args.marbles,
+            marble_render=args.marbles_render,
+            sample_type_list=MontePyFile.log_spaced_counts(*args.log_trials) if args.log_trials else args.trials,
+            engine=args.engine,
+            workers=args.workers,
+            seed=rng_provider,
+            store=make_store(args, rng_provider.seed),
+            sampler=args.sampler,
+            checkpoint=checkpoint,
+            cache=cache,
+            sweep=args.sweep,
+            distributed=make_coordinator(args)
+        )
+    elif args.command == "adaptive":
+        if args.target_se is None and args.target_ci_width is None:
+            build_parser().error("adaptive needs --target-se or --target-ci-width")
+        MontePyFile.run_adaptive_estimate(
+            args.target_se, args.target_ci_width, args.batch_size, args.max_samples, args.max_seconds,
+            args.sampler, rng_provider, progress=args.progress
+        )
+    elif args.command == "samplers":
+        MontePyFile.compare_samplers(args.trials, args.replications, args.samplers, rng_provider)
+    elif args.command == "dice":
+        DicePyFile.calculate_exact_probability()
+        DicePyFile.calculate_simulated_probability(
+            args.trials, engine=args.engine, keep_trials=args.keep_trials, rng=rng_provider,
+            store=make_store(args, rng_provider.seed), checkpoint=checkpoint, cache=cache,
+            distributed=make_coordinator(args), progress=args.progress
+        )
+    elif args.command == "family":
+        FamilyPyFile.family_simulation(
+            args.trials, args.curve_engine, rng_provider, export_trials=not args.no_trial_records,
+            store=make_store(args, rng_provider.seed), cache=cache, engine=args.engine, children=args.children,
+            p_girl=args.p_girl, plot=not args.no_plot
+        )
+    elif args.command == "marbles":
+        MarblesPyFile.mcs_MarblesDropSimulation(args.count, args.render, rng_provider, cache, args.engine)
+
+
+# Call Main() to run the script, or the command line interface when arguments are given
 if __name__ == "__main__":
-    Main()
+    if len(sys.argv) > 1:
+        run_cli()
+    else:
+        Main()
 
 
 
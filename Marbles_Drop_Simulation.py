@@ -1,67 +1,167 @@
-import random
-import math
-from statistics import mean
-import matplotlib
-matplotlib.use('Agg')  # Non-GUI backend for matplotlib
-import matplotlib.pyplot as plt
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
-from openpyxl.styles import Alignment
+import numpy as np
 
+from Instrumentation import add_count, phase
+from Plotting import PLOT_LOCK, pyplot
+from Result_Cache import cached_call
+from Rng_Provider import as_generator
+from Geometry import DROP_AREA, UNIT_CIRCLE, UNIT_SQUARE, classify_points
 
-def mcs_MarblesDropSimulation():
+# Resolution (x bins, y bins) of the density image over the [-2, 4] x [-2, 2] drop area
+DENSITY_BINS = (1200, 800)
+# Number of marbles generated per batch by the density simulation
+DENSITY_CHUNK_SIZE = 1_000_000
+
+# count = None asks for the number of marbles interactively
+# render = "scatter" plots every marble, render = "density" bins them into a fixed-size image
+# cache is an optional Result_Cache.ResultCache, a seeded run then copies its image from the cache
+# engine = "jit" classifies the scatter marbles with the Jit_Kernels.classify_marbles kernel
+def mcs_MarblesDropSimulation(count=None, render="scatter", rng=None, cache=None, engine="numpy"):
 
     try:
         print("!! This section will not effect monte carlo simulation calculations !!")
-        count = int(input("Enter the number of marbles to drop: "))
+        if count is None:
+            count = int(input("Enter the number of marbles to drop: "))
         if count < 1:
             print("Please enter a positive integer greater than 0.")
             return
-        DrawTable(count)
+        cached_call(cache, "marbles", {"count": count, "render": render}, rng,
+                    lambda: DrawTable(count, render, rng, engine), files=["monte_carlo_simulation.png"])
     except ValueError:
         print("Invalid input. Please enter a valid positive integer.")
         return
 
-def simulation(RunCount):
+# Returns the drop counts and the (n, 2) arrays of rectangle, circle and out of bounds points
+# engine = "numpy" classifies with Geometry.classify_points, engine = "jit" marble by marble in a kernel
+def simulation(RunCount, rng=None, engine="numpy"):
     # Circle center = (0,0) and Radius = 1
     # Rectangle:  x = 2 to 3, y = -0.5 to 0.5
+    rng = as_generator(rng)
+    x_min, x_max, y_min, y_max = DROP_AREA
+
+    x = rng.uniform(x_min, x_max, RunCount)
+    y = rng.uniform(y_min, y_max, RunCount)
+    points = np.column_stack((x, y))
+
+    if engine == "numpy":
+        counts, indices = classify_points(x, y, [UNIT_SQUARE, UNIT_CIRCLE], return_indices=True)
+    elif engine == "jit":
+        from Jit_Kernels import classify_marbles
+        regions = classify_marbles(x, y)
+        indices = [np.flatnonzero(regions == region) for region in range(3)]
+        counts = [index.size for index in indices]
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. Use 'numpy' or 'jit'.")
+    RectangleDropCount, CircleDropCount, _ = counts
+    RectanglePoints, CirclePoints, OutOfBoundsPoints = (points[region] for region in indices)
+
+    return RectangleDropCount, CircleDropCount, RectanglePoints, CirclePoints, OutOfBoundsPoints
+
+# Count the marbles per region on a fixed DENSITY_BINS grid while they are generated in batches,
+# so memory does not grow with RunCount. Returns the drop counts and one 2D histogram per region
+def simulation_density(RunCount, bins=DENSITY_BINS, chunk_size=DENSITY_CHUNK_SIZE, rng=None):
+    rng = as_generator(rng)
+    x_bins, y_bins = bins
+    x_min, x_max, y_min, y_max = DROP_AREA
 
     RectangleDropCount = 0
     CircleDropCount = 0
-    RectanglePoints = []
-    CirclePoints = []
-    OutOfBoundsPoints = []
-
-    for _ in range(RunCount):
-        x = random.uniform(-2,4)
-        y = random.uniform(-2,2)
-
-        if(x > 2 and x < 3 and y > -0.5 and y < 0.5):
-            RectangleDropCount += 1
-            RectanglePoints.append((x, y))
-        elif(x**2 + y**2 <= 1):
-            CircleDropCount += 1
-            CirclePoints.append((x, y))
-        else:
-            OutOfBoundsPoints.append((x, y))
+    RectangleDensity = np.zeros(x_bins * y_bins, dtype=np.int64)
+    CircleDensity = np.zeros(x_bins * y_bins, dtype=np.int64)
+    OutOfBoundsDensity = np.zeros(x_bins * y_bins, dtype=np.int64)
 
-    return RectangleDropCount, CircleDropCount, RectanglePoints, CirclePoints, OutOfBoundsPoints
+    remaining = RunCount
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        x = rng.uniform(x_min, x_max, size)
+        y = rng.uniform(y_min, y_max, size)
+
+        counts, (in_rectangle, in_circle, out_of_bounds) = classify_points(
+            x, y, [UNIT_SQUARE, UNIT_CIRCLE], return_indices=True)
+
+        # Flat bin index of every marble
+        x_index = np.minimum(((x - x_min) / (x_max - x_min) * x_bins).astype(np.int64), x_bins - 1)
+        y_index = np.minimum(((y - y_min) / (y_max - y_min) * y_bins).astype(np.int64), y_bins - 1)
+        flat_index = x_index * y_bins + y_index
+
+        RectangleDensity += np.bincount(flat_index[in_rectangle], minlength=RectangleDensity.size)
+        CircleDensity += np.bincount(flat_index[in_circle], minlength=CircleDensity.size)
+        OutOfBoundsDensity += np.bincount(flat_index[out_of_bounds], minlength=OutOfBoundsDensity.size)
+
+        RectangleDropCount += counts[0]
+        CircleDropCount += counts[1]
+        remaining -= size
+
+    densities = [density.reshape(x_bins, y_bins) for density in (RectangleDensity, CircleDensity, OutOfBoundsDensity)]
+
+    return RectangleDropCount, CircleDropCount, *densities
+
+def DrawTable(RunCount = 100000, render="scatter", rng=None, engine="numpy"):
+    if render == "density":
+        DrawDensity(RunCount, rng=rng)
+        return
+    if render != "scatter":
+        raise ValueError(f"Unknown render mode '{render}'. Use 'scatter' or 'density'.")
+
+    with phase("sampling"):
+        RectangleDropCount, CircleDropCount, RectanglePoints, CirclePoints, OutOfBoundsPoints = simulation(RunCount, rng, engine)
+        add_count("samples", RunCount)
+
+    with phase("plotting"), PLOT_LOCK:
+        plt = pyplot()
+
+        # Separate x and y coordinates for plotting
+        rect_x, rect_y = RectanglePoints[:, 0], RectanglePoints[:, 1]
+        circ_x, circ_y = CirclePoints[:, 0], CirclePoints[:, 1]
+        outOB_x, outOB_y = OutOfBoundsPoints[:, 0], OutOfBoundsPoints[:, 1]
+
+        # Plot the points
+        plt.figure(figsize=(12, 9))
+        plt.scatter(outOB_x, outOB_y, color='black', s=0.5, alpha=0.3, label="Out of Bounds Points")
+        plt.scatter(rect_x, rect_y, color='green', s=.5, alpha=1, label="Rectangle Points")
+        plt.scatter(circ_x, circ_y, color='red', s=.5, alpha=1, label="Circle Points")
+
+        SavePlot(RunCount, markerscale=10, scatterpoints=1)
+
+# Render the marbles as one density image, the cost does not depend on how many marbles were dropped
+def DrawDensity(RunCount = 100000, bins=DENSITY_BINS, rng=None):
+    with phase("sampling"):
+        RectangleDropCount, CircleDropCount, RectangleDensity, CircleDensity, OutOfBoundsDensity = \
+            simulation_density(RunCount, bins, rng=rng)
+        add_count("samples", RunCount)
+
+    with phase("plotting"), PLOT_LOCK:
+        plt = pyplot()
+        from matplotlib.patches import Patch
 
-def DrawTable(RunCount = 100000):
-    RectangleDropCount, CircleDropCount, RectanglePoints, CirclePoints, OutOfBoundsPoints = simulation(RunCount)
+        # Blend the regions into one RGBA image: each region has its colour, the alpha grows with the marble count
+        image = np.zeros(RectangleDensity.shape + (4,))
+        regions = [
+            (OutOfBoundsDensity, (0.0, 0.0, 0.0), 0.3),
+            (RectangleDensity, (0.0, 0.5, 0.0), 1.0),
+            (CircleDensity, (1.0, 0.0, 0.0), 1.0),
+        ]
+        for density, colour, max_alpha in regions:
+            if density.max() == 0:
+                continue
+            alpha = max_alpha * np.log1p(density) / np.log1p(density.max())
+            mask = density > 0
+            image[mask, :3] = colour
+            image[mask, 3] = alpha[mask]
 
-    # Separate x and y coordinates for plotting
-    rect_x, rect_y = zip(*RectanglePoints)
-    circ_x, circ_y = zip(*CirclePoints)
-    outOB_x, outOB_y = zip(*OutOfBoundsPoints)
+        # Rows of the image are y, columns are x
+        plt.figure(figsize=(12, 9))
+        plt.imshow(image.transpose(1, 0, 2), origin='lower', extent=(-2, 4, -2, 2), aspect='auto', interpolation='nearest')
 
-    # Plot the points
-    plt.figure(figsize=(12, 9))
-    plt.scatter(outOB_x, outOB_y, color='black', s=0.5, alpha=0.3, label="Out of Bounds Points")
-    plt.scatter(rect_x, rect_y, color='green', s=.5, alpha=1, label="Rectangle Points")
-    plt.scatter(circ_x, circ_y, color='red', s=.5, alpha=1, label="Circle Points")
+        legend_handles = [
+            Patch(color='black', alpha=0.3, label="Out of Bounds Points"),
+            Patch(color='green', label="Rectangle Points"),
+            Patch(color='red', label="Circle Points"),
+        ]
+        SavePlot(RunCount, handles=legend_handles)
 
+# Shared axes, title and legend of the marble plots, then save the figure
+def SavePlot(RunCount, **legend_options):
+    plt = pyplot()
     # Configure plot
     plt.xlim(-2, 4)
     plt.ylim(-2, 2)
@@ -78,13 +178,13 @@ def DrawTable(RunCount = 100000):
         ncol=3, 
         fontsize=10, 
         frameon=True,
-        markerscale=10,  # Increases the size of legend markers
-        scatterpoints=1  # Number of points displayed for scatter legend
+        **legend_options  # markerscale and scatterpoints for scatter plots, patch handles for density images
     )
     # plt.show()
     
     # Save the plot as a PNG file 
     plt.savefig("monte_carlo_simulation.png")
+    plt.close()
     print("Plot saved as 'monte_carlo_simulation.png'")
 
 
@@ -1,98 +1,543 @@
-import random
+import os
 import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
 from statistics import mean
-import matplotlib
-matplotlib.use('Agg')  # Non-GUI backend for matplotlib
-import matplotlib.pyplot as plt
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
+import numpy as np
 
 import Marbles_Drop_Simulation as MarblesPyFile
-
-
-def Monte_Carlo_Simulation():
-    experiments_count = int(input("How many experiments do you need to run each time? "))
-    show_graph = input("Do you want to display the simulation graph? (y/n): ").lower() == 'y'
-    save_to_excel_flag = input("Do you want to save the results to an existing Excel file? (y/n): ").lower() == 'y'
-    save_marble_dropping_image = input("Would you like to save the marble dropping areas image from the simulation? (y/n): ").lower() == 'y'
-
+from Excel_Export import save_workbook, workbook_lock
+from Geometry import UNIT_CIRCLE, UNIT_SQUARE, classify_points
+from Instrumentation import add_count, phase, timed
+from Output_Pipeline import run_output
+from Plotting import PLOT_LOCK, pyplot
+from Result_Cache import cached_call
+from Rng_Provider import as_generator, as_python_random, make_provider
+from Running_Statistics import RatioStatistics
+from Samplers import available_samplers, make_sampler
+from Streaming import Snapshot, show_progress
+
+# Number of points generated per NumPy batch, keeps memory bounded for very large trial counts
+NUMPY_CHUNK_SIZE = 1_000_000
+# Marbles per shard of a distributed run, consecutive experiments are grouped until a shard holds this many
+PI_SHARD_TRIALS = 10_000_000
+
+
+# Every parameter left as None is asked for interactively, so batch jobs can pass them all as arguments
+# seed is an int or an Rng_Provider.RngProvider, the marble image and every experiment get their own child stream
+# output is an optional Output_Pipeline.OutputPipeline that draws the plot and updates the workbook in the background
+def Monte_Carlo_Simulation(experiments_count=None, show_graph=None, save_to_excel_flag=None,
+                           save_marble_dropping_image=None, marble_count=None, marble_render="scatter",
+                           sample_type_list=None,
+                           engine="numpy", workers=1, seed=None, store=None, sampler="uniform", checkpoint=None,
+                           cache=None, sweep=False, distributed=None, output=None):
+    if experiments_count is None:
+        experiments_count = int(input("How many experiments do you need to run each time? "))
+    if show_graph is None:
+        show_graph = input("Do you want to display the simulation graph? (y/n): ").lower() == 'y'
+    if save_to_excel_flag is None:
+        save_to_excel_flag = input("Do you want to save the results to an existing Excel file? (y/n): ").lower() == 'y'
+    if save_marble_dropping_image is None:
+        save_marble_dropping_image = input("Would you like to save the marble dropping areas image from the simulation? (y/n): ").lower() == 'y'
+
+
+    rng_provider = make_provider(seed)
 
     if save_marble_dropping_image:
-        MarblesPyFile.mcs_MarblesDropSimulation()
+        # A one-part key, so it never collides with the (sample type, experiment) keys of the experiments
+        MarblesPyFile.mcs_MarblesDropSimulation(marble_count, marble_render, rng_provider.child(0), cache)
     
-    sample_type_list = [1000, 10000, 100000, 1000000]
+    if sample_type_list is None:
+        sample_type_list = [1000, 10000, 100000, 1000000]
 
     # Run the simulation and log the results
-    pi_results, probability_list = run_simulation_and_log(sample_type_list, experiments_count)
+    with phase("sampling"):
+        pi_results, probability_list = run_simulation_and_log(sample_type_list, experiments_count, engine, workers,
+                                                              rng_provider, store, sampler, checkpoint,
+                                                              cache, sweep, distributed)
 
     # Calculate statistics and plot the graph
-    calculate_statistics_and_plot(pi_results, show_graph)
+    calculate_statistics_and_plot(pi_results, show_graph, output)
 
     # Save the results to an Excel file
     if save_to_excel_flag:
         file_path = "./Coursework.xlsx"
         sheet_name = "Monte Carlo Simulation"
-        update_excel_file(file_path, sheet_name, sample_type_list, pi_results, probability_list)
+        run_output(output, update_excel_file, file_path, sheet_name, sample_type_list, pi_results, probability_list)
+
+    return pi_results, probability_list
     
     
 # Run the simulation and log the results
-def run_simulation_and_log(sample_type_list, experiments_count):
+# workers > 1 fans the experiments out over a process pool, seed (an int or an RngProvider) makes every run reproducible
+# store is an optional Result_Store.RunWriter that receives each sample type's experiments as they complete
+# sampler picks the point sampler of the numpy engine (see Samplers.SAMPLERS)
+# checkpoint is an optional Checkpoint.Checkpoint: the finished experiments are saved periodically and an interrupted
+# run with the same parameters only runs the missing ones, with the same results as an uninterrupted run
+# cache is an optional Result_Cache.ResultCache for seeded runs without a store
+# sweep = True draws one stream per experiment up to the largest sample size and reads every smaller sample size off
+# its prefix (see sweep_marbles), instead of a fresh stream per (sample size, experiment)
+# distributed is an optional Distributed.Coordinator that runs the experiments as shards on its workers instead of
+# the local process pool, with the same streams and so the same results
+def run_simulation_and_log(sample_type_list, experiments_count, engine="scalar", workers=1, seed=None, store=None,
+                           sampler="uniform", checkpoint=None, cache=None, sweep=False, distributed=None):
+    if cache is not None and store is None:
+        parameters = {"sample_type_list": sample_type_list, "experiments_count": experiments_count,
+                      "engine": engine, "sampler": sampler, "sweep": sweep}
+        return cached_call(cache, "pi", parameters, make_provider(seed), lambda: run_simulation_and_log(
+            sample_type_list, experiments_count, engine, workers, seed, None, sampler, checkpoint, sweep=sweep,
+            distributed=distributed))
+
     pi_results = {count: [] for count in sample_type_list}
     probability_list = []
 
-    for sample_type in sample_type_list:
-        print(f"\nRunning {experiments_count} experiments for {sample_type} trials...")
+    # Every (sample_type, experiment) pair gets its own child stream, so the results are bit-identical
+    # whatever the worker count or the order the experiments finish in
+    rng_provider = make_provider(seed)
+    tasks = []
+    for type_index, sample_type in enumerate(sample_type_list):
         for experiment in range(experiments_count):
-            pi_estimate, prob_circle, prob_square, prob_union= drop_marbles(sample_type)
-
-            probability_record = {
-            "Round": experiment + 1,
-            "Trial Count": sample_type,
-            "Probability Circle": prob_circle,
-            "Probability Square": prob_square,
-            "Probability Union": prob_union
-            }
-            probability_list.append(probability_record)
-            pi_results[sample_type].append(pi_estimate)
-            print(f"Experiment {experiment + 1}: Estimated Pi = {pi_estimate:.6f}")
+            tasks.append((sample_type, experiment, engine, sampler, rng_provider.child(type_index, experiment)))
+
+    # A sweep runs one task per experiment over every sample size, logged as the tasks above.
+    # Its streams have three-part keys, so they never collide with the marble image or the experiment keys
+    log_tasks = tasks
+    run_task = run_experiment
+    if sweep:
+        sweep_sample_types = sorted(set(sample_type_list))
+        tasks = [(sweep_sample_types, experiment, engine, sampler, rng_provider.child(0, 0, experiment))
+                 for experiment in range(experiments_count)]
+        run_task = run_sweep_experiment
+
+    if distributed is not None:
+        if checkpoint is not None or sweep:
+            raise ValueError("Distributed runs do not support checkpoints or sweeps.")
+        results = distributed_results(distributed, tasks)
+        log_experiment_results(tasks, results, experiments_count, pi_results, probability_list, store)
+        if store is not None:
+            store.set_summary(mean_pi={str(count): mean(estimates) for count, estimates in pi_results.items()})
+        return pi_results, probability_list
+
+    # Results of the experiments finished before an interrupted run stopped, by task index
+    completed = {}
+    if checkpoint is not None:
+        saved_state = checkpoint.start({
+            "sample_type_list": sample_type_list, "experiments_count": experiments_count, "engine": engine,
+            "sampler": sampler, "seed": rng_provider.seed, "bit_generator": rng_provider.bit_generator, "sweep": sweep,
+        })
+        if saved_state is not None:
+            completed = {int(index): tuple(result) for index, result in saved_state["completed"].items()}
+    pending_tasks = [task for index, task in enumerate(tasks) if index not in completed]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1:
+        print(f"\nRunning experiments on {workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(run_task, pending_tasks, chunksize=max(1, len(pending_tasks) // (workers * 4)))
+            results = checkpointed_results(len(tasks), completed, results, checkpoint)
+            if sweep:
+                results = sweep_results(sample_type_list, experiments_count, results)
+            log_experiment_results(log_tasks, results, experiments_count, pi_results, probability_list, store,
+                                   count_samples=not sweep)
+    else:
+        results = checkpointed_results(len(tasks), completed, map(run_task, pending_tasks), checkpoint)
+        if sweep:
+            results = sweep_results(sample_type_list, experiments_count, results)
+        log_experiment_results(log_tasks, results, experiments_count, pi_results, probability_list, store,
+                               count_samples=not sweep)
+    if sweep:
+        add_count("samples", max(sample_type_list) * experiments_count)  # Only the largest sample size is drawn
+
+    if checkpoint is not None:
+        checkpoint.finish()
+
+    if store is not None:
+        store.set_summary(mean_pi={str(count): mean(estimates) for count, estimates in pi_results.items()})
 
     return pi_results, probability_list
 
+# Run a single experiment with its own random stream (top-level so the process pool can pickle it)
+def run_experiment(task):
+    sample_type, experiment, engine, sampler, rng_provider = task
+    return drop_marbles(sample_type, engine, make_rng(engine, rng_provider), sampler)
+
+# Run the experiment tasks on a Distributed.Coordinator. Every shard is a run of consecutive tasks of about
+# PI_SHARD_TRIALS marbles, and its workers only send back the hit counts of each experiment
+def distributed_results(coordinator, tasks, shard_trials=PI_SHARD_TRIALS):
+    shards = [[]]
+    shard_size = 0
+    for task in tasks:
+        if shard_size >= shard_trials:
+            shards.append([])
+            shard_size = 0
+        shards[-1].append(task)
+        shard_size += task[0]
+
+    hits = [experiment_hits for shard_hits in coordinator.run("pi", shards) for experiment_hits in shard_hits]
+    return [hit_probabilities(circle_hits, square_hits, task[0]) for (circle_hits, square_hits), task in zip(hits, tasks)]
+
+# Worker side of a distributed pi run: the (circle_hits, square_hits) accumulator of every task in the shard
+def pi_shard(tasks):
+    return [count_hits(sample_type, engine, make_rng(engine, rng_provider), sampler)
+            for sample_type, _, engine, sampler, rng_provider in tasks]
+
+# Run one experiment of a sweep over every sample size with its own random stream. The (pi, circle, square, union)
+# results of the sample sizes are flattened into one tuple, so a checkpoint saves them like a single experiment
+def run_sweep_experiment(task):
+    sample_types, experiment, engine, sampler, rng_provider = task
+    results = sweep_marbles(sample_types, engine, make_rng(engine, rng_provider), sampler)
+    return tuple(value for result in results for value in result)
+
+# Split the flattened sweep results (one per experiment, in experiment order) into one result per
+# (sample size, experiment) in the task order of log_experiment_results
+def sweep_results(sample_type_list, experiments_count, results):
+    results = list(results)
+    sweep_sample_types = sorted(set(sample_type_list))
+    for sample_type in sample_type_list:
+        offset = 4 * sweep_sample_types.index(sample_type)
+        for experiment in range(experiments_count):
+            yield results[experiment][offset:offset + 4]
+
+# Merge the results of the new experiments (in task order) with the ones restored from a checkpoint,
+# saving the checkpoint whenever it is due
+def checkpointed_results(task_count, completed, new_results, checkpoint=None):
+    new_results = iter(new_results)
+    for index in range(task_count):
+        if index not in completed:
+            completed[index] = tuple(float(value) for value in next(new_results))
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save({"completed": {str(done): list(result) for done, result in completed.items()}})
+        yield completed[index]
+
+# Build the random generator the engine expects from the experiment's provider
+def make_rng(engine, rng_provider):
+    if engine in ("numpy", "jit"):
+        return rng_provider.generator()
+    return rng_provider.python_random()
+
+# Collect the experiment results in task order into the pi_results / probability_list layout
+# count_samples = False leaves the "samples" counter to the caller (a sweep draws fewer samples than it logs)
+def log_experiment_results(tasks, results, experiments_count, pi_results, probability_list, store=None,
+                           count_samples=True):
+    for (sample_type, experiment, _, _, _), result in zip(tasks, results):
+        pi_estimate, prob_circle, prob_square, prob_union = result
+
+        if experiment == 0:
+            print(f"\nRunning {experiments_count} experiments for {sample_type} trials...")
+
+        probability_record = {
+        "Round": experiment + 1,
+        "Trial Count": sample_type,
+        "Probability Circle": prob_circle,
+        "Probability Square": prob_square,
+        "Probability Union": prob_union
+        }
+        probability_list.append(probability_record)
+        pi_results[sample_type].append(pi_estimate)
+        if count_samples:
+            add_count("samples", sample_type)
+        print(f"Experiment {experiment + 1}: Estimated Pi = {pi_estimate:.6f}")
+
+        # Persist the sample type as one batch once all of its experiments are in
+        if store is not None and experiment == experiments_count - 1:
+            store_experiments(store, sample_type, pi_results[sample_type], probability_list[-experiments_count:])
+
+# Append one sample type's experiments to the result store, hit counts included
+def store_experiments(store, sample_type, pi_estimates, probability_records):
+    probability_circle = np.array([record["Probability Circle"] for record in probability_records])
+    probability_square = np.array([record["Probability Square"] for record in probability_records])
+
+    store.append(
+        "experiments",
+        trial_count=np.full(len(pi_estimates), sample_type, dtype=np.int64),
+        round=np.array([record["Round"] for record in probability_records], dtype=np.int64),
+        pi_estimate=np.array(pi_estimates),
+        circle_hits=np.rint(probability_circle * sample_type).astype(np.int64),
+        square_hits=np.rint(probability_square * sample_type).astype(np.int64),
+        probability_circle=probability_circle,
+        probability_square=probability_square,
+        probability_union=np.array([record["Probability Union"] for record in probability_records])
+    )
+
 # Function to drop marbles and estimate Pi
-def drop_marbles(num_trials):
+# engine = "scalar" uses the original pure-Python loop, engine = "numpy" uses the batched array engine,
+# engine = "jit" runs the per-marble loop as a Jit_Kernels kernel (compiled when numba is installed)
+# rng is optional: a random.Random for the scalar engine or a numpy Generator for the numpy and jit engines
+# sampler other than "uniform" (quasi-random, stratified, antithetic, importance) needs the numpy engine
+def drop_marbles(num_trials, engine="scalar", rng=None, sampler="uniform"):
+    circle_hits, square_hits = count_hits(num_trials, engine, rng, sampler)
+    return hit_probabilities(circle_hits, square_hits, num_trials)
+
+# (circle_hits, square_hits) of num_trials marbles on the given engine, see drop_marbles
+def count_hits(num_trials, engine="scalar", rng=None, sampler="uniform"):
+    if engine == "scalar":
+        if sampler != "uniform":
+            raise ValueError(f"The '{sampler}' sampler needs the numpy engine.")
+        circle_hits, square_hits = count_hits_scalar(num_trials, rng)
+    elif engine == "numpy":
+        circle_hits, square_hits = count_hits_numpy(num_trials, rng=rng, sampler=sampler)
+    elif engine == "jit":
+        if sampler != "uniform":
+            raise ValueError(f"The '{sampler}' sampler needs the numpy engine.")
+        circle_hits, square_hits = count_hits_jit(num_trials, rng=rng)
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. Use 'scalar', 'numpy' or 'jit'.")
+
+    return circle_hits, square_hits
+
+# Pi estimate and region probabilities of num_trials marbles with the given hits
+def hit_probabilities(circle_hits, square_hits, num_trials):
+    estimated_pi = circle_hits / square_hits if square_hits != 0 else 0
+    prob_circle = circle_hits / num_trials
+    prob_square = square_hits / num_trials
+    prob_union = (circle_hits + square_hits) / num_trials
+
+    return estimated_pi, prob_circle, prob_square, prob_union
+
+# Drop one stream of marbles up to the largest of sample_types and read the cumulative hits off at every
+# sample size on the way, so each sample size is a prefix of the same stream and the stream is drawn only once.
+# Returns one (estimated_pi, prob_circle, prob_square, prob_union) tuple per sample size, in ascending order
+def sweep_marbles(sample_types, engine="scalar", rng=None, sampler="uniform"):
+    if engine == "scalar":
+        if sampler != "uniform":
+            raise ValueError(f"The '{sampler}' sampler needs the numpy engine.")
+        rng = as_python_random(rng)
+        count_hits = lambda size: count_hits_scalar(size, rng)
+    elif engine == "numpy":
+        point_sampler = make_sampler(sampler, as_generator(rng))
+        count_hits = lambda size: count_hits_numpy(size, point_sampler=point_sampler)
+    elif engine == "jit":
+        if sampler != "uniform":
+            raise ValueError(f"The '{sampler}' sampler needs the numpy engine.")
+        point_sampler = make_sampler("uniform", as_generator(rng))
+        count_hits = lambda size: count_hits_jit(size, point_sampler=point_sampler)
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. Use 'scalar', 'numpy' or 'jit'.")
+
+    results = []
+    circle_hits = 0
+    square_hits = 0
+    completed = 0
+    for sample_type in sorted(sample_types):
+        circle_count, square_count = count_hits(sample_type - completed)
+        circle_hits += circle_count
+        square_hits += square_count
+        completed = sample_type
+        results.append(hit_probabilities(circle_hits, square_hits, sample_type))
+
+    return results
+
+# Sorted distinct sample sizes spread evenly on a log scale from smallest to largest (both included),
+# for dense convergence sweeps. Rounding can merge neighbours, so there may be fewer than count
+def log_spaced_counts(smallest, largest, count):
+    if not 1 <= smallest <= largest or count < 1:
+        raise ValueError(f"Log-spaced sample sizes need 1 <= smallest <= largest and count >= 1, "
+                         f"got {smallest}, {largest} and {count}.")
+    return sorted({int(round(value)) for value in np.geomspace(smallest, largest, count)})
+
+# Drop the marbles one by one with the random module
+def count_hits_scalar(num_trials, rng=None):
+    rng = as_python_random(rng)
     circle_hits = 0
     square_hits = 0
 
     for _ in range(num_trials):
-        x = random.uniform(-2, 4)
-        y = random.uniform(-2, 2)
+        x = rng.uniform(-2, 4)
+        y = rng.uniform(-2, 2)
 
         if (2 < x < 3 and -0.5 < y < 0.5):
             square_hits += 1
         elif x**2 + y**2 <= 1:
             circle_hits += 1
 
-    estimated_pi = circle_hits / square_hits if square_hits != 0 else 0
-    prob_circle = circle_hits / num_trials
-    prob_square = square_hits / num_trials
-    prob_union = (circle_hits + square_hits) / num_trials
+    return circle_hits, square_hits
 
-    return estimated_pi, prob_circle, prob_square, prob_union
+# Drop the marbles in fixed-size NumPy batches and classify them with the shared geometry kernel
+# With an importance sampler the hits are weighted, so they are no longer whole numbers
+# point_sampler continues a sampler that already drew points (a sweep), otherwise one is made from rng and sampler
+def count_hits_numpy(num_trials, chunk_size=NUMPY_CHUNK_SIZE, rng=None, sampler="uniform", point_sampler=None):
+    if point_sampler is None:
+        point_sampler = make_sampler(sampler, as_generator(rng))
+    circle_hits = 0
+    square_hits = 0
+
+    remaining = num_trials
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        x, y, weights = point_sampler.draw(size)
+
+        if weights is None:
+            square_count, circle_count, _ = classify_points(x, y, [UNIT_SQUARE, UNIT_CIRCLE])
+        else:
+            _, (in_square, in_circle, _) = classify_points(x, y, [UNIT_SQUARE, UNIT_CIRCLE], return_indices=True)
+            square_count = float(weights[in_square].sum())
+            circle_count = float(weights[in_circle].sum())
+
+        square_hits += square_count
+        circle_hits += circle_count
+        remaining -= size
+
+    return circle_hits, square_hits
+
+# Draw the same uniform batches as the numpy engine and count the hits marble by marble in a kernel,
+# so a seed gives the same counts on the numpy engine and on both kernel backends
+def count_hits_jit(num_trials, chunk_size=NUMPY_CHUNK_SIZE, rng=None, point_sampler=None):
+    from Jit_Kernels import count_marble_hits
+    if point_sampler is None:
+        point_sampler = make_sampler("uniform", as_generator(rng))
+    circle_hits = 0
+    square_hits = 0
+
+    remaining = num_trials
+    while remaining > 0:
+        size = min(chunk_size, remaining)
+        x, y, _ = point_sampler.draw(size)
+        circle_count, square_count = count_marble_hits(x, y)
+        circle_hits += int(circle_count)
+        square_hits += int(square_count)
+        remaining -= size
+
+    return circle_hits, square_hits
+
+# Compare the variance of the pi estimate of every sampler with the uniform baseline at a fixed sample size.
+# Returns {sampler: (mean pi, variance, variance reduction factor against uniform)}
+def compare_samplers(num_trials, replications=20, samplers=None, seed=None):
+    if samplers is None:
+        samplers = available_samplers()
+    if "uniform" not in samplers:
+        samplers = ["uniform"] + list(samplers)
+
+    rng_provider = make_provider(seed)
+    comparison = {}
+
+    print(f"\nComparing samplers over {replications} replications of {num_trials} trials:")
+    for sampler_index, sampler in enumerate(samplers):
+        estimates = [drop_marbles(num_trials, "numpy", rng_provider.generator(sampler_index, replication), sampler)[0]
+                     for replication in range(replications)]
+        comparison[sampler] = [float(np.mean(estimates)), float(np.var(estimates, ddof=1))]
+
+    baseline_variance = comparison["uniform"][1]
+    for sampler, (mean_pi, variance) in comparison.items():
+        reduction = baseline_variance / variance if variance > 0 else math.inf
+        comparison[sampler] = (mean_pi, variance, reduction)
+        print(f"{sampler:>10}: Mean Pi = {mean_pi:.6f}, Variance = {variance:.3e}, "
+              f"Variance Reduction = {reduction:.1f}x")
+
+    return comparison
+
+# Stream the pi estimate: draw batch_size points at a time and yield a Streaming.Snapshot after every batch with the
+# running circle and square hits, the estimate, its delta-method standard error and the samples/sec so far.
+# max_samples = None keeps sampling until the consumer stops. Memory stays at one batch for any run length
+def stream_pi_estimates(max_samples=None, batch_size=100_000, sampler="uniform", rng=None):
+    point_sampler = make_sampler(sampler, as_generator(rng))
+    statistics = RatioStatistics()
+    start_time = time.perf_counter()
+
+    while max_samples is None or statistics.count < max_samples:
+        size = batch_size if max_samples is None else min(batch_size, max_samples - statistics.count)
+        x, y, weights = point_sampler.draw(size)
+
+        _, (in_square, in_circle, _) = classify_points(x, y, [UNIT_SQUARE, UNIT_CIRCLE], return_indices=True)
+        circle_values = np.zeros(size)
+        square_values = np.zeros(size)
+        circle_values[in_circle] = 1.0 if weights is None else weights[in_circle]
+        square_values[in_square] = 1.0 if weights is None else weights[in_square]
+        statistics.update_batch(circle_values, square_values)
+        add_count("samples", size)
+
+        yield pi_snapshot(statistics, time.perf_counter() - start_time)
+
+# Streaming.Snapshot of the pi estimate held by a RatioStatistics of circle and square hits
+def pi_snapshot(statistics, elapsed_seconds):
+    return Snapshot(statistics.count, {"circle_hits": statistics.sum_a, "square_hits": statistics.sum_b},
+                    statistics.ratio, statistics.standard_error, elapsed_seconds)
+
+# Pass the snapshots of a stream on until the standard error meets the target or max_seconds have passed,
+# then cancel the stream
+def until_converged(snapshots, target_standard_error, max_seconds=None):
+    try:
+        for snapshot in snapshots:
+            yield snapshot
+            if snapshot.standard_error <= target_standard_error:
+                return
+            if max_seconds is not None and snapshot.elapsed_seconds >= max_seconds:
+                return
+    finally:
+        snapshots.close()
+
+# Keep drawing batches until the standard error of pi meets the target (given directly or as a confidence interval
+# width), or until the sample or time budget runs out. The error is the delta-method error of the ratio
+# circle hits / square hits, which assumes i.i.d. points, so it is conservative for the quasi-random samplers
+# progress = True shows a progress line for every batch
+@timed("sampling")
+def run_adaptive_estimate(target_standard_error=None, target_ci_width=None, batch_size=100_000, max_samples=10**9,
+                          max_seconds=None, sampler="uniform", seed=None, z=1.96, progress=False):
+    if target_standard_error is None and target_ci_width is None:
+        raise ValueError("Give a target standard error or a target confidence interval width.")
+    if target_standard_error is None:
+        target_standard_error = target_ci_width / (2 * z)
+    elif target_ci_width is not None:
+        target_standard_error = min(target_standard_error, target_ci_width / (2 * z))
+
+    start_time = time.perf_counter()
+    snapshots = until_converged(stream_pi_estimates(max_samples, batch_size, sampler, make_provider(seed).generator()),
+                                target_standard_error, max_seconds)
+    snapshot = pi_snapshot(RatioStatistics(), 0.0)  # Kept when the sample budget allows no batch
+    if progress:
+        snapshot = show_progress(snapshots, max_samples, "Adaptive estimate", z) or snapshot
+    else:
+        for snapshot in snapshots:
+            pass
+
+    if snapshot.standard_error <= target_standard_error:
+        stop_reason = "target reached"
+    elif max_seconds is not None and snapshot.elapsed_seconds >= max_seconds:
+        stop_reason = "time budget"
+    else:
+        stop_reason = "sample budget"
+
+    wall_time = time.perf_counter() - start_time
+    estimated_pi = snapshot.estimate
+    standard_error = snapshot.standard_error
+
+    result = {
+        "Estimated Pi": estimated_pi,
+        "Standard Error": standard_error,
+        "Confidence Interval": snapshot.confidence_interval(z),
+        "Samples Used": snapshot.samples,
+        "Wall Time": wall_time,
+        "Converged": stop_reason == "target reached",
+        "Stop Reason": stop_reason,
+    }
+
+    print(f"\nAdaptive estimate: Pi = {estimated_pi:.6f} +/- {z * standard_error:.6f} "
+          f"({stop_reason}, {snapshot.samples} samples in {wall_time:.2f} s)")
+
+    return result
 
 # Calculate statistics and plot the graph
-def calculate_statistics_and_plot(pi_results, show_graph=True):
+def calculate_statistics_and_plot(pi_results, show_graph=True, output=None):
     trial_counts = list(pi_results.keys())
     means = []    
     
-    print("\nStatistical Summary:")
-    for num_trials, estimates in pi_results.items():
-        mean_pi = mean(estimates)        
-        means.append(mean_pi)      
+    with phase("statistics"):
+        print("\nStatistical Summary:")
+        for num_trials, estimates in pi_results.items():
+            mean_pi = mean(estimates)        
+            means.append(mean_pi)      
         
-        print(f"For N = {num_trials}: Mean Pi = {mean_pi:.6f}")
+            print(f"For N = {num_trials}: Mean Pi = {mean_pi:.6f}")
     
     if show_graph:
+        run_output(output, plot_pi_estimates, trial_counts, means)
+
+# Line plot of the mean Pi estimate of every sample size
+def plot_pi_estimates(trial_counts, means):
+    with phase("plotting"), PLOT_LOCK:
+        plt = pyplot()
         plt.figure(figsize=(10, 6))
         plt.plot([str(tc) for tc in trial_counts], means, marker='o', color='b', label='Mean Pi')
         plt.axhline(y=math.pi, color='r', linestyle='--', label="Actual Pi")
@@ -102,116 +547,198 @@ def calculate_statistics_and_plot(pi_results, show_graph=True):
         plt.legend()
         plt.grid(True)
         plt.savefig('pi_estimate_plot.png')
+        plt.close()
         print("Plot saved as 'pi_estimate_plot.png'.")
 
 
-# Update the Excel file with the simulation results
+# Layout of the "Monte Carlo Simulation" sheet. The pi table starts in column C, and the block on its right
+# (mean/mode summary, notes and the probability table) starts two columns after the last sample size:
+# column H for the original four sample sizes
+MONTE_CARLO_FIRST_PI_ROW = 7
+MONTE_CARLO_NOTE_ROWS = range(12, 16)
+MONTE_CARLO_FIRST_ROUND_ROW = 18
+
+# Template text of the sheet, used when the sheet does not have it yet
+MONTE_CARLO_LABELS = {
+    "pi_header": "Pi estimated value - N",
+    "summary_header": "Statistical Summery",
+    "mean": "Mean",
+    "mode": "Mode",
+    "trial_number": "Trial Number",
+    "probability": "Probability",
+    "probability_header": "Pi Estimated value - N",
+}
+
+# First column of the block right of the pi table
+def right_block_column(sample_count):
+    return sample_count + 4
+
+# Number of sample sizes in the sheet, read from the "N = ..." headers in row 6
+def sheet_sample_count(sheet):
+    sample_count = 0
+    while str(sheet.cell(row=6, column=3 + sample_count).value or "").startswith("N = "):
+        sample_count += 1
+    return sample_count or 4
+
+# Every template cell of the sheet for sample_count sample sizes: (role, row, column) of the top left cell,
+# with the last column and row of its merged range
+def template_cells(sample_count):
+    right = right_block_column(sample_count)
+    cells = [
+        ("pi_header", 5, 3, 2 + sample_count, 5),
+        ("summary_header", 5, right + 1, right + sample_count, 5),
+        ("mean", 7, right, right, 7),
+        ("mode", 8, right, right, 8),
+        ("trial_number", 16, right, right, 17),
+        ("probability", 16, right + 1, right + 1, 17),
+        ("probability_header", 16, right + 2, right + 1 + sample_count, 16),
+    ]
+    cells += [(f"note {row}", row, right, right + 1 + sample_count, row) for row in MONTE_CARLO_NOTE_ROWS]
+    return cells
+
+# Update the Excel file with the simulation results.
+# The old block is unmerged and cleared in bulk and the new one written column by column, so the update time
+# does not grow with the merged ranges left by earlier runs, and any number of sample sizes fits
+@timed("excel export")
 def update_excel_file(file_path, sheet_name, trial_counts, pi_results, probability_list):
-
-    book = load_workbook(file_path)
-    if sheet_name not in book.sheetnames:
-        print(f"Sheet '{sheet_name}' not found.")
-        return
-
-    sheet = book[sheet_name]
-
-    # Clear existing data in the table
-    for row in sheet.iter_rows(min_row=7, max_row=sheet.max_row, min_col=2, max_col=6):
-        for cell in row:
-            cell.value = None
-
-    # Clear previous data for mean and mode in I7:L8 (Mean in row 7, Mode in row 8)
-    for row in range(7, 9):  
-        for col in range(9, 13):  
-            sheet.cell(row=row, column=col).value = None
-
-    # Fill in trial numbers in column B
-    trial_numbers = list(range(1, len(next(iter(pi_results.values()))) + 1))
-    for row_idx, trial_number in enumerate(trial_numbers, start=7):
-        sheet.cell(row=row_idx, column=2, value=trial_number)
-
-    # Fill in Pi estimates in columns C-F
-    for col_idx, count in enumerate(trial_counts, start=3):
-        pi_values = pi_results[count]
-        for row_idx, pi_value in enumerate(pi_values, start=7):
-            sheet.cell(row=row_idx, column=col_idx, value=round(pi_value, 6))
-
-    
-    columns = ['C', 'D', 'E', 'F']  # Corresponding to trial_counts in C, D, E, F
-    for col_idx, column_letter in enumerate(columns, start=9):  # Columns I to L correspond to 9 to 12
-        count = len(pi_results[trial_counts[col_idx - 9]])
-        mean_formula = f"=AVERAGE({column_letter}7:{column_letter}{6 + count})"  # Mean formula
-        mode_formula = f"=MODE({column_letter}7:{column_letter}{6 + count})"    # Mode formula
-
-        sheet.cell(row=7, column=col_idx, value=mean_formula)  # Insert mean formula in row 7 (I7:L7)
-        sheet.cell(row=8, column=col_idx, value=mode_formula)  # Insert mode formula in row 8 (I8:L8)
-
-
-    update_excel_file_probability(sheet, probability_list)
-
-    
-    # Save the workbook
-    book.save(file_path)
+    from openpyxl import load_workbook
+
+    # One load-modify-save at a time per workbook, the output pipeline may be writing it too
+    with workbook_lock(file_path):
+        book = load_workbook(file_path)
+        if sheet_name not in book.sheetnames:
+            print(f"Sheet '{sheet_name}' not found.")
+            return
+
+        sheet = book[sheet_name]
+        old_sample_count = sheet_sample_count(sheet)
+        template = capture_template(sheet, old_sample_count)
+        clear_monte_carlo_block(sheet, old_sample_count, len(trial_counts))
+
+        write_template(sheet, template, trial_counts)
+        round_count = len(next(iter(pi_results.values())))
+        update_excel_file_pi(sheet, template, trial_counts, pi_results, round_count)
+        update_excel_file_probability(sheet, template, trial_counts, probability_list)
+
+        # Save the workbook
+        save_workbook(book, file_path)
+    add_count("rows written", round_count + 3 * max_round_count(probability_list))
     print(f"Data in sheet '{sheet_name}' has been replaced successfully.")
 
 
-def update_excel_file_probability(sheet,probability_list):
-    # --- Remove Previous Records from Excel Sheet 
-    start_col = 'H'
-    end_col = 'M'
-
-    # Clear cells from start_row to the last row in the sheet, from start_col to end_col
-    for row in range(18, sheet.max_row + 1):
-        for col in range(column_index_from_string(start_col), column_index_from_string(end_col) + 1):
-            cell = sheet.cell(row=row, column=col)
-            if not any(cell.coordinate in merged_cell for merged_cell in sheet.merged_cells.ranges):
+# Number of rounds in the probability records (each round takes three rows of the sheet)
+def max_round_count(probability_list):
+    return max((item['Round'] for item in probability_list), default=0)
+
+# Text and style of every template cell, plus the styles of the data cells, read before the block is cleared
+def capture_template(sheet, sample_count):
+    right = right_block_column(sample_count)
+    template = {"text": {}, "style": {}}
+    for role, row, column, _, _ in template_cells(sample_count):
+        cell = sheet.cell(row=row, column=column)
+        template["text"][role] = cell.value if cell.value is not None else MONTE_CARLO_LABELS.get(role)
+        template["style"][role] = copy(cell._style)
+
+    data_cells = {
+        "sample_header": (6, 3), "trial": (MONTE_CARLO_FIRST_PI_ROW, 2), "pi": (MONTE_CARLO_FIRST_PI_ROW, 3),
+        "summary_sample_header": (6, right + 1), "formula": (7, right + 1),
+        "probability_sample_header": (17, right + 2), "round": (MONTE_CARLO_FIRST_ROUND_ROW, right),
+        "letter": (MONTE_CARLO_FIRST_ROUND_ROW, right + 1), "probability_value": (MONTE_CARLO_FIRST_ROUND_ROW, right + 2),
+    }
+    for role, (row, column) in data_cells.items():
+        template["style"][role] = copy(sheet.cell(row=row, column=column)._style)
+    return template
+
+# Unmerge and clear everything the previous run wrote: the pi table (trial numbers from row 7, headers from row 5)
+# and the block on its right. The merged ranges overlapping the old or the new block are looked up once,
+# instead of scanning every merged range for every cell
+def clear_monte_carlo_block(sheet, old_sample_count, new_sample_count):
+    last_column = right_block_column(old_sample_count) + 1 + old_sample_count
+    new_last_column = right_block_column(new_sample_count) + 1 + new_sample_count
+
+    merged_in_block = [merged for merged in sheet.merged_cells.ranges
+                       if merged.max_row >= 5 and merged.max_col >= 3
+                       and merged.min_col <= max(last_column, new_last_column)]
+    for merged in merged_in_block:
+        sheet.unmerge_cells(merged.coord)
+
+    for min_row, min_col, max_col in ((5, 3, last_column), (MONTE_CARLO_FIRST_PI_ROW, 2, 2)):
+        for row in sheet.iter_rows(min_row=min_row, max_row=sheet.max_row, min_col=min_col, max_col=max_col):
+            for cell in row:
                 cell.value = None
-
-
-    # Find the maximum round value
-    max_round = max(item['Round'] for item in probability_list)
-
-    # Loop through each round and update the cells
-    for loopRound in range(max_round):
-        rowNumber = loopRound * 3 + 18  # Starting from I15
-        columnLetter = 'I'
-        columnLetter2 = 'H'
-
-        # Set the round value
-        sheet[f'{columnLetter2}{rowNumber}'] = loopRound + 1
-        sheet[f'{columnLetter}{rowNumber}'] = 'A'
-        sheet[f'{columnLetter}{rowNumber + 1}'] = 'B'
-        sheet[f'{columnLetter}{rowNumber + 2}'] = 'C'
-
-        # Merge cells for the round value
-        sheet.merge_cells(f'{columnLetter2}{rowNumber}:{columnLetter2}{rowNumber + 2}')
-
-    # Loop through the probability list and update the cells
+                cell.style = "Normal"
+
+def write_cell(sheet, row, column, value, style):
+    cell = sheet.cell(row=row, column=column, value=value)
+    cell._style = copy(style)
+    return cell
+
+# Headers, labels and notes of the sheet, laid out for the new sample sizes
+def write_template(sheet, template, trial_counts):
+    from openpyxl.utils import get_column_letter
+
+    sample_count = len(trial_counts)
+    right = right_block_column(sample_count)
+    for role, row, column, last_column, last_row in template_cells(sample_count):
+        write_cell(sheet, row, column, template["text"][role], template["style"][role])
+        if last_column > column or last_row > row:
+            sheet.merge_cells(f"{get_column_letter(column)}{row}:{get_column_letter(last_column)}{last_row}")
+
+    for index, count in enumerate(trial_counts):
+        write_cell(sheet, 6, 3 + index, f"N = {count}", template["style"]["sample_header"])
+        write_cell(sheet, 6, right + 1 + index, f"N = {count}", template["style"]["summary_sample_header"])
+        write_cell(sheet, 17, right + 2 + index, f"N = {count}", template["style"]["probability_sample_header"])
+
+# Trial numbers in column B, one column of pi estimates per sample size from column C,
+# and the mean and mode formulas of each column in the summary
+def update_excel_file_pi(sheet, template, trial_counts, pi_results, round_count):
+    from openpyxl.utils import get_column_letter
+
+    first_row = MONTE_CARLO_FIRST_PI_ROW
+    last_row = first_row + round_count - 1
+    right = right_block_column(len(trial_counts))
+
+    for row in range(first_row, last_row + 1):
+        write_cell(sheet, row, 2, row - first_row + 1, template["style"]["trial"])
+
+    for index, count in enumerate(trial_counts):
+        column = 3 + index
+        for row, pi_value in enumerate(pi_results[count], start=first_row):
+            write_cell(sheet, row, column, round(pi_value, 6), template["style"]["pi"])
+
+        column_letter = get_column_letter(column)
+        write_cell(sheet, 7, right + 1 + index, f"=AVERAGE({column_letter}{first_row}:{column_letter}{last_row})",
+                   template["style"]["formula"])
+        write_cell(sheet, 8, right + 1 + index, f"=MODE({column_letter}{first_row}:{column_letter}{last_row})",
+                   template["style"]["formula"])
+
+# Probability table: each round takes three rows (A = circle, B = square, C = union) under a merged round number,
+# with one column per sample size
+def update_excel_file_probability(sheet, template, trial_counts, probability_list):
+    from openpyxl.utils import get_column_letter
+
+    right = right_block_column(len(trial_counts))
+    round_column = get_column_letter(right)
+
+    for loopRound in range(max_round_count(probability_list)):
+        rowNumber = loopRound * 3 + MONTE_CARLO_FIRST_ROUND_ROW
+        write_cell(sheet, rowNumber, right, loopRound + 1, template["style"]["round"])
+        for offset, letter in enumerate("ABC"):
+            write_cell(sheet, rowNumber + offset, right + 1, letter, template["style"]["letter"])
+        sheet.merge_cells(f"{round_column}{rowNumber}:{round_column}{rowNumber + 2}")
+
+    # Group the records by sample size, then write each sample size's column top to bottom
+    columns = {count: [] for count in trial_counts}
     for item in probability_list:
-        round_number = item['Round']
-        rowNumber = (round_number - 1) * 3 + 18  # Adjusting for 0-based index
-        columnLetter = 'H'
-
-        if item['Trial Count'] == 1000:
-            columnLetter = 'J'
-            sheet[f'{columnLetter}{rowNumber}'] = item['Probability Circle']
-            sheet[f'{columnLetter}{rowNumber + 1}'] = item['Probability Square']
-            sheet[f'{columnLetter}{rowNumber + 2}'] = item['Probability Union']
-        elif item['Trial Count'] == 10000:
-            columnLetter = 'K'
-            sheet[f'{columnLetter}{rowNumber}'] = item['Probability Circle']
-            sheet[f'{columnLetter}{rowNumber + 1}'] = item['Probability Square']
-            sheet[f'{columnLetter}{rowNumber + 2}'] = item['Probability Union']
-        elif item['Trial Count'] == 100000:
-            columnLetter = 'L'
-            sheet[f'{columnLetter}{rowNumber}'] = item['Probability Circle']
-            sheet[f'{columnLetter}{rowNumber + 1}'] = item['Probability Square']
-            sheet[f'{columnLetter}{rowNumber + 2}'] = item['Probability Union']
-        elif item['Trial Count'] == 1000000:
-            columnLetter = 'M'
-            sheet[f'{columnLetter}{rowNumber}'] = item['Probability Circle']
-            sheet[f'{columnLetter}{rowNumber + 1}'] = item['Probability Square']
-            sheet[f'{columnLetter}{rowNumber + 2}'] = item['Probability Union']
+        columns[item['Trial Count']].append(item)
+
+    for index, count in enumerate(trial_counts):
+        column = right + 2 + index
+        for item in sorted(columns[count], key=lambda record: record['Round']):
+            rowNumber = (item['Round'] - 1) * 3 + MONTE_CARLO_FIRST_ROUND_ROW
+            write_cell(sheet, rowNumber, column, item['Probability Circle'], template["style"]["probability_value"])
+            write_cell(sheet, rowNumber + 1, column, item['Probability Square'], template["style"]["probability_value"])
+            write_cell(sheet, rowNumber + 2, column, item['Probability Union'], template["style"]["probability_value"])
 
 
 
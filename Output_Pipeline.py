@@ -0,0 +1,70 @@
+import atexit
+import queue
+import threading
+import traceback
+
+# Finished outputs that may wait for the background stage, submit() blocks once this many are queued
+OUTPUT_QUEUE_SIZE = 4
+
+
+# Background output stage: plots and exports run on one worker thread in the order they were submitted, while the
+# caller goes on with the next simulation. A single thread keeps matplotlib (not thread-safe) and the writes to
+# a workbook in order. The queue is bounded, so a caller that outruns the disk waits instead of piling up results.
+# check_errors() raises the error of the first output that failed so far without waiting, flush() waits for every
+# queued output first, close() also stops the thread. Open pipelines are closed at interpreter exit, so no queued
+# output is lost
+class OutputPipeline:
+
+    def __init__(self, max_pending=OUTPUT_QUEUE_SIZE):
+        self.tasks = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.thread = threading.Thread(target=self.run, name="output-pipeline", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Queue function(*args, **kwargs). The arguments must not change afterwards, the worker reads them later
+    def submit(self, function, *args, **kwargs):
+        if self.thread is None:
+            raise RuntimeError("The output pipeline is closed.")
+        self.tasks.put((function, args, kwargs))
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                function, args, kwargs = task
+                function(*args, **kwargs)
+            except Exception as error:
+                traceback.print_exc()
+                self.errors.append(error)
+            finally:
+                self.tasks.task_done()
+
+    def check_errors(self):
+        if self.errors:
+            error = self.errors[0]
+            self.errors.clear()
+            raise RuntimeError(f"A background output failed: {error}") from error
+
+    def flush(self):
+        self.tasks.join()
+        self.check_errors()
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.tasks.put(None)
+        self.thread.join()
+        self.thread = None
+        atexit.unregister(self.close)
+        self.flush()
+
+
+# Run function(*args, **kwargs) on the output pipeline, or right away when there is none
+def run_output(output, function, *args, **kwargs):
+    if output is None:
+        function(*args, **kwargs)
+    else:
+        output.submit(function, *args, **kwargs)
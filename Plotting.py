@@ -0,0 +1,16 @@
+import threading
+
+# matplotlib takes longer to import than the simulations need for a short run, so it is only imported
+# the first time a plot is drawn
+
+# pyplot keeps one global current figure, so a plot drawn on the output pipeline's thread and one drawn on the main
+# thread must not interleave. Every plotting block holds this lock from plt.figure() to plt.close()
+PLOT_LOCK = threading.RLock()
+
+
+# pyplot with the non-GUI backend, imported on first use
+def pyplot():
+    import matplotlib
+    matplotlib.use('Agg')  # Non-GUI backend for matplotlib
+    import matplotlib.pyplot as plt
+    return plt
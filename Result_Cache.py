@@ -0,0 +1,114 @@
+import glob
+import hashlib
+import json
+import os  # Required for file operations
+import pickle
+import shutil
+import time
+from functools import lru_cache
+
+from Defaults import CACHE_DIR, MAX_CACHE_BYTES
+from Rng_Provider import RngProvider
+
+_MISSING = object()
+
+
+# Persistent cache of simulation results and rendered images, keyed by (simulation name, parameters, seed, code version).
+# Layout: <root>/<key>/value.pickle plus a copy of every output file of the run. The modification time of an entry
+# folder is its last use, and the least recently used entries are evicted once the cache grows past max_bytes
+class ResultCache:
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, simulation, parameters, seed):
+        description = {"simulation": simulation, "parameters": parameters, "seed": seed, "code": code_version()}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key, default=None):
+        entry_dir = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry_dir, "value.pickle"), "rb") as file:
+                value = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return default
+        os.utime(entry_dir)  # Mark the entry as recently used
+        return value
+
+    # Save a value and copies of the given output files, built in a temporary folder so readers never see half an entry
+    def put(self, key, value, files=()):
+        entry_dir = os.path.join(self.root, key)
+        temporary_dir = os.path.join(self.root, f".tmp-{key}-{os.getpid()}")
+        os.makedirs(temporary_dir, exist_ok=True)
+        with open(os.path.join(temporary_dir, "value.pickle"), "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        for path in files:
+            shutil.copyfile(path, os.path.join(temporary_dir, os.path.basename(path)))
+
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.replace(temporary_dir, entry_dir)
+        self.evict()
+
+    # Copy the cached output files back to their original paths
+    def restore_files(self, key, files):
+        for path in files:
+            shutil.copyfile(os.path.join(self.root, key, os.path.basename(path)), path)
+
+    # Remove the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        for entry_dir in glob.glob(os.path.join(self.root, "*")):
+            size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(entry_dir, "*")))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+
+# Hash of the simulation source files, so a code change never serves results of the old code
+@lru_cache(maxsize=None)
+def code_version():
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+# The reproducible seed of an rng argument: (entropy, spawn key, bit generator) of an RngProvider, an int seed as is,
+# None for anything that cannot be replayed (no seed, or a Generator that is already running)
+def replayable_seed(rng):
+    if isinstance(rng, RngProvider):
+        return [rng.seed, list(rng.seed_sequence.spawn_key), rng.bit_generator]
+    if isinstance(rng, int):
+        return rng
+    return None
+
+# compute() through the cache: a hit returns the cached value and restores the cached output files,
+# a miss runs compute() and caches its value and files. Runs without a replayable seed are never cached
+def cached_call(cache, simulation, parameters, rng, compute, files=()):
+    seed = replayable_seed(rng)
+    if cache is None or seed is None:
+        return compute()
+
+    start_time = time.perf_counter()
+    key = cache.key(simulation, parameters, seed)
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        cache.restore_files(key, files)
+        print(f"Loaded cached {simulation} results in {time.perf_counter() - start_time:.3f} s")
+        return value
+
+    value = compute()
+    cache.put(key, value, files)
+    return value
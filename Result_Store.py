@@ -0,0 +1,93 @@
+import os  # Required for file operations
+import glob
+import json
+import time
+import uuid
+import numpy as np
+
+from Defaults import RESULTS_DIR
+
+
+# Append-only columnar writer for one simulation run.
+# Layout: <root>/<run_id>/run.json holds the simulation name, parameters, seed and summary values,
+# <root>/<run_id>/<table>/<column>.<batch>.npy holds one column of one appended batch
+class RunWriter:
+
+    def __init__(self, simulation, parameters, seed=None, run_id=None, root=RESULTS_DIR, save_raw=True):
+        self.run_id = run_id or f"{simulation}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(root, self.run_id)
+        self.save_raw = save_raw  # False keeps only the aggregated tables
+        self._batch_numbers = {}
+
+        os.makedirs(self.path, exist_ok=True)
+        self.metadata = {
+            "run_id": self.run_id,
+            "simulation": simulation,
+            "parameters": parameters,
+            "seed": seed,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "summary": {},
+        }
+        self._write_metadata()
+
+    # Append one batch of equally long columns to a table, e.g. append("experiments", pi=[...], trial_count=[...])
+    def append(self, table, **columns):
+        table_path = os.path.join(self.path, table)
+        os.makedirs(table_path, exist_ok=True)
+
+        batch_number = self._batch_numbers.get(table)
+        if batch_number is None:
+            # Continue after the batches already on disk
+            existing = [int(os.path.basename(path).split(".")[1]) for path in glob.glob(os.path.join(table_path, "*.npy"))]
+            batch_number = max(existing) + 1 if existing else 0
+        self._batch_numbers[table] = batch_number + 1
+
+        for column, values in columns.items():
+            file_path = os.path.join(table_path, f"{column}.{batch_number:06d}.npy")
+            temp_path = file_path + ".tmp"
+            with open(temp_path, "wb") as file:
+                np.save(file, np.asarray(values))
+            os.replace(temp_path, file_path)  # A batch only becomes visible once it is complete
+
+    # Record aggregated scalar results (probabilities, counts) in run.json
+    def set_summary(self, **values):
+        self.metadata["summary"].update(values)
+        self._write_metadata()
+
+    def _write_metadata(self):
+        file_path = os.path.join(self.path, "run.json")
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.metadata, file, indent=2, default=str)
+        os.replace(temp_path, file_path)
+
+
+# Metadata of every stored run, oldest first
+def list_runs(root=RESULTS_DIR):
+    runs = [load_run_metadata(os.path.basename(os.path.dirname(path)), root)
+            for path in glob.glob(os.path.join(root, "*", "run.json"))]
+    return sorted(runs, key=lambda run: run["created"])
+
+def load_run_metadata(run_id, root=RESULTS_DIR):
+    with open(os.path.join(root, run_id, "run.json")) as file:
+        return json.load(file)
+
+# Memory-mapped arrays of every batch of one column, in append order
+def load_column_batches(run_id, table, column, root=RESULTS_DIR, mmap=True):
+    pattern = os.path.join(root, run_id, table, f"{column}.*.npy")
+    return [np.load(path, mmap_mode="r" if mmap else None) for path in sorted(glob.glob(pattern))]
+
+# One column as a single array (memory-mapped when the column was written in one batch)
+def load_column(run_id, table, column, root=RESULTS_DIR, mmap=True):
+    batches = load_column_batches(run_id, table, column, root, mmap)
+    if not batches:
+        raise FileNotFoundError(f"Column '{column}' of table '{table}' not found in run '{run_id}'.")
+    return batches[0] if len(batches) == 1 else np.concatenate(batches)
+
+# A whole table as a pandas DataFrame
+def load_table(run_id, table, root=RESULTS_DIR):
+    import pandas as pd
+
+    table_path = os.path.join(root, run_id, table)
+    columns = sorted({os.path.basename(path).split(".")[0] for path in glob.glob(os.path.join(table_path, "*.npy"))})
+    return pd.DataFrame({column: load_column(run_id, table, column, root, mmap=False) for column in columns})
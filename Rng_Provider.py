@@ -0,0 +1,84 @@
+import random
+import numpy as np
+
+from Defaults import BIT_GENERATOR_NAMES
+
+# Bit generators a provider can build its numpy Generators from
+BIT_GENERATORS = {name: getattr(np.random, name) for name in BIT_GENERATOR_NAMES}
+
+
+# Central source of random streams, built on numpy SeedSequence.
+# Child streams are addressed by a key path, e.g. provider.generator(sample_index, experiment, chunk), so every
+# experiment, worker or chunk gets the same independent stream whatever order (or process) it runs in.
+# Providers only hold a SeedSequence, so they can be pickled to worker processes
+class RngProvider:
+
+    def __init__(self, seed=None, bit_generator="PCG64", seed_sequence=None):
+        if bit_generator not in BIT_GENERATORS:
+            raise ValueError(f"Unknown bit generator '{bit_generator}'. Use one of: {', '.join(BIT_GENERATORS)}.")
+        self.bit_generator = bit_generator
+        self.seed_sequence = seed_sequence if seed_sequence is not None else np.random.SeedSequence(seed)
+
+    # The entropy the provider was built from, pass it back as seed to reproduce an unseeded run
+    @property
+    def seed(self):
+        return self.seed_sequence.entropy
+
+    # Provider for the sub-stream at key, its own children extend the key path
+    def child(self, *key):
+        if not key:
+            return self
+        child_sequence = np.random.SeedSequence(
+            entropy=self.seed_sequence.entropy,
+            spawn_key=tuple(self.seed_sequence.spawn_key) + tuple(int(part) for part in key),
+            pool_size=self.seed_sequence.pool_size,
+        )
+        return RngProvider(bit_generator=self.bit_generator, seed_sequence=child_sequence)
+
+    # numpy Generator for the stream at key
+    def generator(self, *key):
+        seed_sequence = self.child(*key).seed_sequence
+        return np.random.Generator(BIT_GENERATORS[self.bit_generator](seed_sequence))
+
+    # random.Random for the stream at key, for the pure-Python loops
+    def python_random(self, *key):
+        seed_sequence = self.child(*key).seed_sequence
+        return random.Random(int.from_bytes(seed_sequence.generate_state(4, np.uint64).tobytes(), "little"))
+
+
+# Provider from a seed (None, int, SeedSequence) or an existing provider
+def make_provider(seed=None, bit_generator="PCG64"):
+    if isinstance(seed, RngProvider):
+        return seed
+    if isinstance(seed, np.random.SeedSequence):
+        return RngProvider(bit_generator=bit_generator, seed_sequence=seed)
+    return RngProvider(seed, bit_generator)
+
+# numpy Generator from anything the simulations accept as rng: None, a seed, a SeedSequence,
+# a Generator or an RngProvider
+def as_generator(rng=None):
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if isinstance(rng, RngProvider):
+        return rng.generator()
+    return np.random.default_rng(rng)
+
+# count uint64 words of 64 random bits from a numpy Generator. Unlike bit_generator.random_raw(), which only fills
+# 32 bits per word on MT19937, this holds full-width bits on every bit generator (and gives the same words as
+# random_raw() on the 64-bit ones)
+def random_words(rng, count):
+    return rng.integers(0, 2**64, size=count, dtype=np.uint64)
+
+# count random uint32 values from a numpy Generator, the halves of random_words(rng, count / 2)
+def random_uint32(rng, count):
+    return random_words(rng, -(-count // 2)).view(np.uint32)[:count]
+
+# random.Random-like object for the pure-Python loops. None keeps the global random module
+def as_python_random(rng=None):
+    if rng is None or isinstance(rng, random.Random):
+        return random if rng is None else rng
+    if isinstance(rng, RngProvider):
+        return rng.python_random()
+    if isinstance(rng, np.random.Generator):
+        return random.Random(int(rng.integers(0, 2**63)))
+    return make_provider(rng).python_random()
@@ -0,0 +1,97 @@
+import math
+import numpy as np
+
+
+# Incremental statistics over a stream of values, every update is O(1)
+# Mean and variance use Welford's algorithm, so long runs do not lose precision
+class RunningStatistics:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0  # Running sum (number of successes for 0/1 values)
+        self.mean = 0.0
+        self._sum_squared_deviations = 0.0
+
+    def update(self, value):
+        value = float(value)
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._sum_squared_deviations += delta * (value - self.mean)
+
+    # Sample variance of the values seen so far
+    @property
+    def variance(self):
+        return self._sum_squared_deviations / (self.count - 1) if self.count > 1 else 0.0
+
+    # Standard error of the running mean
+    @property
+    def standard_error(self):
+        return math.sqrt(self.variance / self.count) if self.count > 0 else 0.0
+
+    # Wilson score interval of the running mean, for 0/1 (success/failure) values
+    def wilson_interval(self, z=1.96):
+        return wilson_interval(self.total, self.count, z)
+
+
+# Batch accumulator for a ratio of means mean(a) / mean(b), e.g. circle hits over square hits.
+# Keeps the sums needed for the delta-method standard error: Var(R) ~ (Var(a) - 2R Cov(a, b) + R^2 Var(b)) / (n mean(b)^2)
+class RatioStatistics:
+
+    def __init__(self):
+        self.count = 0
+        self.sum_a = 0.0
+        self.sum_b = 0.0
+        self.sum_aa = 0.0
+        self.sum_bb = 0.0
+        self.sum_ab = 0.0
+
+    def update_batch(self, a, b):
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        self.count += a.size
+        self.sum_a += float(a.sum())
+        self.sum_b += float(b.sum())
+        self.sum_aa += float(np.dot(a, a))
+        self.sum_bb += float(np.dot(b, b))
+        self.sum_ab += float(np.dot(a, b))
+
+    @property
+    def ratio(self):
+        return self.sum_a / self.sum_b if self.sum_b != 0 else 0.0
+
+    @property
+    def standard_error(self):
+        if self.count < 2 or self.sum_b == 0:
+            return math.inf
+
+        n = self.count
+        mean_a = self.sum_a / n
+        mean_b = self.sum_b / n
+        variance_a = (self.sum_aa - n * mean_a**2) / (n - 1)
+        variance_b = (self.sum_bb - n * mean_b**2) / (n - 1)
+        covariance = (self.sum_ab - n * mean_a * mean_b) / (n - 1)
+
+        ratio = mean_a / mean_b
+        variance = (variance_a - 2 * ratio * covariance + ratio**2 * variance_b) / (n * mean_b**2)
+        return math.sqrt(max(variance, 0.0))
+
+
+# Wilson score confidence interval of a proportion (successes out of count)
+def wilson_interval(successes, count, z=1.96):
+    if count == 0:
+        return 0.0, 1.0
+
+    p = successes / count
+    denominator = 1 + z**2 / count
+    centre = (p + z**2 / (2 * count)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / count + z**2 / (4 * count**2)) / denominator
+
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+# Running mean after every value of a batch, in one NumPy cumsum pass
+def cumulative_proportions(values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.cumsum(values) / np.arange(1, values.size + 1)
@@ -0,0 +1,170 @@
+import importlib.util
+import warnings
+import numpy as np
+
+from Geometry import DROP_AREA, UNIT_CIRCLE, UNIT_SQUARE
+
+
+# Point samplers for the pi estimator. Every sampler keeps its own state between batches and
+# draw(size) returns (x, y, weights): weights is None when every point counts once, otherwise
+# the importance weight of each point so that mean(weights * hit) is still unbiased for the area fraction
+
+# Scale unit-square points to an (x_min, x_max, y_min, y_max) area
+def scale_to_area(u, v, area):
+    x_min, x_max, y_min, y_max = area
+    return x_min + u * (x_max - x_min), y_min + v * (y_max - y_min)
+
+
+# Plain i.i.d. uniform points, the baseline every other sampler is compared with
+class UniformSampler:
+
+    def __init__(self, rng, area=DROP_AREA):
+        self.rng = rng
+        self.area = area
+
+    def draw(self, size):
+        x, y = scale_to_area(self.rng.random(size), self.rng.random(size), self.area)
+        return x, y, None
+
+
+# Halton low-discrepancy sequence (bases 2 and 3), randomised with a random start and a random shift modulo 1
+class HaltonSampler:
+
+    def __init__(self, rng, area=DROP_AREA):
+        self.area = area
+        self.next_index = int(rng.integers(1, 2**20))
+        self.shift = rng.random(2)
+
+    def draw(self, size):
+        indices = np.arange(self.next_index, self.next_index + size, dtype=np.int64)
+        self.next_index += size
+
+        u = (radical_inverse(indices, 2) + self.shift[0]) % 1.0
+        v = (radical_inverse(indices, 3) + self.shift[1]) % 1.0
+        x, y = scale_to_area(u, v, self.area)
+        return x, y, None
+
+# Van der Corput radical inverse of every index in the given base
+def radical_inverse(indices, base):
+    result = np.zeros(indices.size)
+    remaining = indices.copy()
+    factor = 1.0 / base
+    while np.any(remaining > 0):
+        result += factor * (remaining % base)
+        remaining //= base
+        factor /= base
+    return result
+
+
+# Scrambled Sobol sequence, needs scipy
+class SobolSampler:
+
+    def __init__(self, rng, area=DROP_AREA):
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError("The 'sobol' sampler needs scipy. Install it or use the 'halton' sampler.")
+        self.area = area
+        self.engine = qmc.Sobol(d=2, scramble=True, seed=rng)
+
+    def draw(self, size):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # Sobol balance warnings for sizes that are not powers of two
+            points = self.engine.random(size)
+        x, y = scale_to_area(points[:, 0], points[:, 1], self.area)
+        return x, y, None
+
+
+# Jittered stratified sampling: one point in each cell of an m x m grid, the leftover points are uniform
+class StratifiedSampler:
+
+    def __init__(self, rng, area=DROP_AREA):
+        self.rng = rng
+        self.area = area
+
+    def draw(self, size):
+        cells_per_side = int(np.sqrt(size))
+        cell_count = cells_per_side**2
+
+        cell = np.arange(cell_count)
+        u = (cell // cells_per_side + self.rng.random(cell_count)) / max(cells_per_side, 1)
+        v = (cell % cells_per_side + self.rng.random(cell_count)) / max(cells_per_side, 1)
+
+        leftover = size - cell_count
+        u = np.concatenate((u, self.rng.random(leftover)))
+        v = np.concatenate((v, self.rng.random(leftover)))
+        x, y = scale_to_area(u, v, self.area)
+        return x, y, None
+
+
+# Antithetic variates: every uniform point (u, v) is paired with its mirror (1 - u, 1 - v)
+class AntitheticSampler:
+
+    def __init__(self, rng, area=DROP_AREA):
+        self.rng = rng
+        self.area = area
+
+    def draw(self, size):
+        half = size // 2
+        u = self.rng.random(half + size % 2)
+        v = self.rng.random(half + size % 2)
+        u = np.concatenate((u, 1.0 - u[:half]))
+        v = np.concatenate((v, 1.0 - v[:half]))
+        x, y = scale_to_area(u, v, self.area)
+        return x, y, None
+
+
+# Importance sampling restricted to the bounding boxes of the target shapes.
+# Points come from a mixture of uniform distributions over the boxes (chosen in proportion to box area),
+# and each point is weighted by (uniform density over the drop area) / (mixture density)
+class ImportanceSampler:
+
+    def __init__(self, rng, area=DROP_AREA, shapes=(UNIT_SQUARE, UNIT_CIRCLE)):
+        self.rng = rng
+        self.area = area
+        self.boxes = [shape.bounding_box for shape in shapes]
+        self.box_areas = np.array([(x_max - x_min) * (y_max - y_min) for x_min, x_max, y_min, y_max in self.boxes])
+        self.box_probabilities = self.box_areas / self.box_areas.sum()
+
+        x_min, x_max, y_min, y_max = area
+        self.area_density = 1.0 / ((x_max - x_min) * (y_max - y_min))
+
+    def draw(self, size):
+        box_counts = self.rng.multinomial(size, self.box_probabilities)
+        x_parts = []
+        y_parts = []
+        for box, count in zip(self.boxes, box_counts):
+            x, y = scale_to_area(self.rng.random(count), self.rng.random(count), box)
+            x_parts.append(x)
+            y_parts.append(y)
+        x = np.concatenate(x_parts)
+        y = np.concatenate(y_parts)
+
+        # Mixture density at every point, boxes may overlap
+        mixture_density = np.zeros(size)
+        for (x_min, x_max, y_min, y_max), probability, box_area in zip(self.boxes, self.box_probabilities, self.box_areas):
+            in_box = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+            mixture_density += in_box * (probability / box_area)
+
+        return x, y, self.area_density / mixture_density
+
+
+# Sampler of every name in Defaults.SAMPLER_NAMES
+SAMPLERS = {
+    "uniform": UniformSampler,
+    "halton": HaltonSampler,
+    "sobol": SobolSampler,
+    "stratified": StratifiedSampler,
+    "antithetic": AntitheticSampler,
+    "importance": ImportanceSampler,
+}
+
+# Names of the samplers whose optional dependencies are installed
+def available_samplers():
+    return [name for name in SAMPLERS if name != "sobol" or importlib.util.find_spec("scipy") is not None]
+
+# Create a sampler by name with its own generator
+def make_sampler(name, rng, area=DROP_AREA):
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler '{name}'. Use one of: {', '.join(SAMPLERS)}.")
+    return SAMPLERS[name](rng, area)
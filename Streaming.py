@@ -0,0 +1,50 @@
+import math
+import sys
+
+# Snapshots of an estimate while it is sampled. The stream_* generators of the simulations yield one Snapshot after
+# every batch and only keep the current batch in memory, so a consumer can read them lazily and stop at any point:
+# breaking out of the loop (or calling close() on the generator) cancels the run without sampling another batch
+
+
+# State of a streaming estimate after a batch
+# counts holds the running counts of the simulation (e.g. circle and square hits), estimate and standard_error
+# describe the current estimate, elapsed_seconds is the sampling time since the stream started
+class Snapshot:
+
+    def __init__(self, samples, counts, estimate, standard_error, elapsed_seconds):
+        self.samples = samples
+        self.counts = counts
+        self.estimate = estimate
+        self.standard_error = standard_error
+        self.elapsed_seconds = elapsed_seconds
+
+    @property
+    def samples_per_second(self):
+        return self.samples / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    def confidence_interval(self, z=1.96):
+        return self.estimate - z * self.standard_error, self.estimate + z * self.standard_error
+
+    def __repr__(self):
+        return (f"Snapshot(samples={self.samples}, estimate={self.estimate:.6f}, "
+                f"standard_error={self.standard_error:.6g}, samples_per_second={self.samples_per_second:,.0f})")
+
+
+# Consume a snapshot stream while redrawing one progress line, returns the last snapshot (None for an empty stream).
+# total is the number of samples the stream will draw, when known. The stream is closed on the way out,
+# so an interrupted progress display also stops the sampling
+def show_progress(snapshots, total=None, label="Progress", z=1.96, file=None):
+    file = file if file is not None else sys.stdout
+    snapshot = None
+    try:
+        for snapshot in snapshots:
+            done = f"{snapshot.samples:,}/{total:,} ({snapshot.samples / total:.0%})" if total else f"{snapshot.samples:,}"
+            margin = z * snapshot.standard_error
+            margin_text = f"{margin:.6f}" if math.isfinite(margin) else "inf"
+            print(f"\r{label}: {done} samples, estimate {snapshot.estimate:.6f} +/- {margin_text}, "
+                  f"{snapshot.samples_per_second:,.0f} samples/s", end="", flush=True, file=file)
+    finally:
+        snapshots.close()
+        if snapshot is not None:
+            print(file=file)
+    return snapshot
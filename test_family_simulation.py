@@ -0,0 +1,22 @@
+from math import comb
+
+import numpy as np
+import pytest
+
+import Family_Simulation as FamilyPyFile
+
+FAMILIES = 200_000
+
+
+# Every numpy bit generator must give binomial girl counts on both sampling paths (popcount at p_girl = 0.5,
+# 32-bit thresholds otherwise), including MT19937 whose raw words only hold 32 random bits
+@pytest.mark.parametrize("bit_generator", [np.random.MT19937, np.random.PCG64, np.random.Philox, np.random.SFC64])
+@pytest.mark.parametrize("p_girl", [0.5, 0.49])
+@pytest.mark.parametrize("jit", [False, True])
+def test_girl_counts_are_binomial(bit_generator, p_girl, jit):
+    children = 3
+    frequency = FamilyPyFile.simulate_families(FAMILIES, children, p_girl,
+                                               rng=np.random.Generator(bit_generator(1)), jit=jit)[0]
+    expected = [comb(children, girls) * p_girl**girls * (1 - p_girl)**(children - girls)
+                for girls in range(children + 1)]
+    np.testing.assert_allclose(frequency / FAMILIES, expected, atol=0.005)
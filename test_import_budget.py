@@ -0,0 +1,15 @@
+import Benchmark
+import Defaults
+import Rng_Provider
+import Samplers
+
+
+# Every entry point must import within Benchmark.IMPORT_TIME_BUDGET and leave the heavy modules for later
+def test_entry_points_meet_import_budget():
+    assert Benchmark.check_import_budget() == []
+
+
+# Main builds its parser from the names in Defaults, they must match the registries they stand for
+def test_default_names_match_registries():
+    assert list(Rng_Provider.BIT_GENERATORS) == Defaults.BIT_GENERATOR_NAMES
+    assert list(Samplers.SAMPLERS) == Defaults.SAMPLER_NAMES
@@ -0,0 +1,22 @@
+import pytest
+
+import Benchmark
+import Jit_Kernels as JitPyFile
+
+TRIALS = 20_000
+KERNEL_CHECKS = Benchmark.jit_kernel_checks(TRIALS)
+ENGINE_CHECKS = Benchmark.jit_engine_checks(TRIALS)
+
+
+# Compiled kernels must match their interpreted versions, only meaningful with numba installed
+@pytest.mark.parametrize("name, kernel, arguments", KERNEL_CHECKS, ids=[check[0] for check in KERNEL_CHECKS])
+def test_compiled_kernel_matches_interpreted(name, kernel, arguments):
+    pytest.importorskip("numba")
+    assert JitPyFile.python_kernel(kernel) is not kernel
+    assert Benchmark.kernel_matches(kernel, arguments)
+
+
+# A seed must give the same statistics on the jit engine as on the engine it replaces
+@pytest.mark.parametrize("name, run, reference_engine", ENGINE_CHECKS, ids=[check[0] for check in ENGINE_CHECKS])
+def test_jit_engine_matches_reference(name, run, reference_engine):
+    assert Benchmark.engine_matches(run, reference_engine)